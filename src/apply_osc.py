@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Apply an OsmChange file (.osc) to already cleaned data.
+
+Created and modified nodes, ways and relations are shaped and corrected
+like in `cleaning.process_map`. Their old rows and the rows of deleted
+elements are removed from the SQLite database or the csv files, then the
+new rows are added. Only the elements in the change file are processed,
+instead of the whole OSM file.
+
+The SQLite database is updated in place via its indexes, including the
+spatial index of the nodes and, if they were computed with
+`geometry.py --db`, the geometries of the changed ways and of the ways with
+changed nodes. The csv files are rewritten once without the
+old rows, so there the cost grows with the size of the csv files. The same
+way geometries are updated in `ways_geometry.csv`, if it exists, and the
+node index of `geometry.py` is removed, as it is rebuilt from the nodes.
+"""
+
+import os
+import csv
+import argparse
+import xml.etree.cElementTree as ET
+
+from collections import OrderedDict
+
+import compressed
+import spatial
+import geometry
+import check_correct as CC
+from cleaning import (shape_element, write_correction_report, CsvSink,
+                      CSV_PATHS, ELEMENT_TAGS)
+from sqlite_sink import SqliteSink
+
+ACTIONS = ('create', 'modify', 'delete')
+
+
+def get_changes(osc_file, tags=ELEMENT_TAGS):
+    """Yield tuple of action and element for each element in `osc_file`.
+    Compressed change files (`.osc.gz`) are read as well."""
+
+    source = compressed.open_input(osc_file)
+    try:
+        context = ET.iterparse(source, events=('start', 'end'))
+        _, root = next(context)
+        action = None
+        for event, elem in context:
+            if event == 'start' and elem.tag in ACTIONS:
+                action = elem
+            elif event == 'end' and elem.tag in tags and action is not None:
+                yield action.tag, elem
+                action.clear()
+            elif event == 'end' and elem.tag in ACTIONS:
+                action = None
+                root.clear()
+    finally:
+        source.close()
+
+
+def collect_changes(osc_file):
+    """Shape all created and modified elements of `osc_file`.
+
+    Return dict with (element type, id) as key and the shaped element as
+    value or None, if the element was deleted. If an element changes more
+    than once, its last change is kept.
+    """
+
+    changes = OrderedDict()
+    for action, element in get_changes(osc_file):
+        key = (element.tag, element.attrib['id'])
+        if action == 'delete':
+            changes[key] = None
+        else:
+            changes[key] = shape_element(element, as_tuples=True)
+    return changes
+
+
+def get_ids(changes, element_type):
+    """Return set of ids of the changed elements of `element_type`."""
+
+    return set(element_id for (el_type, element_id) in changes
+               if el_type == element_type)
+
+
+def write_changes(changes, sink):
+    """Write the created and modified elements to `sink`."""
+
+    try:
+        for (element_type, _), el in changes.iteritems():
+            if el is None:
+                continue
+            if element_type == 'node':
+                sink.write_node(el)
+            elif element_type == 'way':
+                sink.write_way(el)
+            elif element_type == 'relation':
+                sink.write_relation(el)
+    finally:
+        sink.close()
+
+
+def apply_to_db(changes, db_path):
+    """Replace the rows of all changed elements in the SQLite database."""
+
+    node_ids = get_ids(changes, 'node')
+    way_ids = get_ids(changes, 'way')
+    sink = SqliteSink(db_path, create=False)
+    sink.delete_nodes(node_ids)
+    sink.delete_ways(way_ids)
+    sink.delete_relations(get_ids(changes, 'relation'))
+    write_changes(changes, sink)
+    spatial.update_nodes(db_path, node_ids)
+    geometry.update_geometry_db(db_path, way_ids, node_ids)
+
+
+def remove_rows(path, ids):
+    """Rewrite csv file at `path` without the rows whose id is in `ids`.
+    Return path of the new file."""
+
+    tmp_path = path + '.tmp'
+    with open(path, 'rb') as f_in, open(tmp_path, 'wb') as f_out:
+        reader = csv.reader(f_in)
+        writer = csv.writer(f_out)
+        writer.writerow(next(reader))
+        for row in reader:
+            if row[0] not in ids:
+                writer.writerow(row)
+    return tmp_path
+
+
+def apply_to_csv(changes, paths=CSV_PATHS):
+    """Replace the rows of all changed elements in the csv files."""
+
+    node_ids = get_ids(changes, 'node')
+    way_ids = get_ids(changes, 'way')
+    relation_ids = get_ids(changes, 'relation')
+    ids = (node_ids, node_ids, way_ids, way_ids, way_ids,
+           relation_ids, relation_ids, relation_ids)
+
+    tmp_paths = [remove_rows(path, element_ids)
+                 for path, element_ids in zip(paths, ids)]
+    write_changes(changes, CsvSink(tmp_paths, header=False, mode='a'))
+
+    for tmp_path, path in zip(tmp_paths, paths):
+        os.rename(tmp_path, path)
+
+    nodes_path, way_nodes_path = paths[0], paths[3]
+    geometry.update_geometry_csv(
+        way_ids, node_ids, nodes_path, way_nodes_path,
+        os.path.join(os.path.dirname(way_nodes_path),
+                     os.path.basename(geometry.WAY_GEOMETRY_PATH)))
+
+
+def apply_osc(osc_file, db_path=None, corrections_path=None,
+              verbose=False):
+    """Apply the changes of `osc_file` to the SQLite database at `db_path`
+    or to the csv files, if no database is given.
+
+    The corrections of the new elements are written to `corrections_path`
+    (see `cleaning.write_correction_report`), with `verbose=True` each one
+    is printed."""
+
+    CC.init_values(verbose)
+    changes = collect_changes(osc_file)
+    if db_path is not None:
+        apply_to_db(changes, db_path)
+    else:
+        apply_to_csv(changes)
+    write_correction_report(CC.CORRECTIONS, corrections_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Apply an OsmChange file to the cleaned data.')
+    parser.add_argument('filename', help='OsmChange file (.osc)')
+    parser.add_argument('--db', dest='db_path',
+                        help='update this SQLite database instead of csv')
+    parser.add_argument('--corrections', dest='corrections_path',
+                        metavar='FILE',
+                        help='write the corrections with their counts to '
+                             'this CSV file (JSON for .json)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print each correction')
+    args = parser.parse_args()
+
+    apply_osc(args.filename, args.db_path, args.corrections_path,
+              args.verbose)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Run several audits of an OSM file in a single pass.
+
+Takes an OSM (XML or PBF) file name as argument. The file is parsed once
+and every tag of the nodes and ways is passed to a set of audit visitors:
+
+- `tags`: count of tag keys and values (like `explore.py`), also saved
+  in the tag index of the OSM file
+- `streets`: bad formed street names (like `audit_street_names.py`)
+- `phones`: harmonized and invalid phone numbers (like `audit_phone_no.py`)
+- `munich`: Munich name variants used as `addr:city`
+
+In the end every visitor writes its report to the output directory.
+More audits can be added by subclassing `AuditVisitor` and registering the
+class in `AUDITS`.
+"""
+
+import os
+import sys
+import argparse
+
+from collections import defaultdict, Counter
+
+import parsers
+import tag_index
+import check_correct as CC
+from util import to_str
+from audit_street_names import audit_street_name, sorted_street_types
+from audit_phone_no import PhoneNormalizer
+
+REPORT_DIR = 'audit-reports'
+
+# Number of tags and values per tag in the tag statistics report
+REPORT_TAGS = 10
+REPORT_VALUES = 20
+
+
+class AuditVisitor(object):
+    """Base class of the audits. `visit_tag` is called for every tag of
+    every node and way, `write_report` once after the file is parsed."""
+
+    name = None
+
+    def visit_tag(self, element_type, element_id, tag_key, tag_value):
+        pass
+
+    def finish(self, filename):
+        """Called after the whole file is parsed."""
+        pass
+
+    def write_report(self, f):
+        pass
+
+
+class TagStatsVisitor(AuditVisitor):
+    """Count tag keys and values per element type."""
+
+    name = 'tags'
+
+    def __init__(self):
+        self.tag_count = defaultdict(Counter)
+        self.tag_values = defaultdict(lambda: defaultdict(Counter))
+
+    def visit_tag(self, element_type, element_id, tag_key, tag_value):
+        self.tag_count[element_type][tag_key] += 1
+        self.tag_values[element_type][tag_key][tag_value] += 1
+
+    def finish(self, filename):
+        # save the counts for later `explore.py` sessions
+        for element_type in ('node', 'way'):
+            tag_index.write_index(filename, element_type, None,
+                                  self.tag_count[element_type],
+                                  self.tag_values[element_type])
+
+    def write_report(self, f):
+        for element_type in ('node', 'way'):
+            tag_count = self.tag_count[element_type]
+            f.write('=== Tags of type `{0}` ===\n'.format(element_type))
+            for tag, count in tag_count.most_common(REPORT_TAGS):
+                values = self.tag_values[element_type][tag]
+                f.write('---\nTag Name:\t{0}\nCount:\t\t{1}\n'
+                        'Unique:\t\t{2}\n-\n'.format(tag, count, len(values)))
+                for value, value_count in values.most_common(REPORT_VALUES):
+                    f.write('{0}\t{1}\n'.format(value_count, value))
+            f.write('\n')
+
+
+class StreetNameVisitor(AuditVisitor):
+    """Collect street names that don't match the street name regex."""
+
+    name = 'streets'
+
+    def __init__(self):
+        self.street_types = Counter()
+        self.sample_ids = {}
+
+    def visit_tag(self, element_type, element_id, tag_key, tag_value):
+        if tag_key == CC.STREET_TAG:
+            audit_street_name(self.street_types, tag_value, self.sample_ids,
+                              element_id)
+
+    def write_report(self, f):
+        for street_name, count, ids in sorted_street_types(
+                self.street_types, self.sample_ids):
+            f.write('{0}\t{1}\t{2}\n'.format(count, street_name,
+                                              ','.join(ids)))
+
+
+class PhoneVisitor(AuditVisitor):
+    """Harmonize the phone numbers and collect the results."""
+
+    name = 'phones'
+
+    def __init__(self):
+        self.normalizer = PhoneNormalizer()
+        self.results = Counter()
+
+    def visit_tag(self, element_type, element_id, tag_key, tag_value):
+        if tag_key == CC.PHONE_TAG:
+            self.results[(tag_value,
+                          self.normalizer.normalize(tag_value))] += 1
+
+    def write_report(self, f):
+        for (phone_no, clean_phone_no), count in self.results.most_common():
+            if clean_phone_no is None:
+                clean_phone_no = '(invalid)'
+            f.write('{0}\t{1}{2}-->\t{3}\n'.format(
+                count, phone_no, ' ' * (24 - len(phone_no)), clean_phone_no))
+        f.write('Cache hits: {0}, misses: {1}\n'.format(
+            self.normalizer.hits, self.normalizer.misses))
+
+
+class MunichNameVisitor(AuditVisitor):
+    """Count the Munich name variants in `addr:city` tags."""
+
+    name = 'munich'
+
+    def __init__(self):
+        self.munich_names = CC.get_munich_names()
+        self.counts = Counter()
+
+    def visit_tag(self, element_type, element_id, tag_key, tag_value):
+        if tag_key == CC.CITY_TAG and tag_value in self.munich_names:
+            self.counts[(element_type, tag_value)] += 1
+
+    def write_report(self, f):
+        for (element_type, city_name), count in self.counts.most_common():
+            f.write('{0}\t{1}\t{2}\n'.format(count, element_type, city_name))
+
+
+AUDITS = {
+    TagStatsVisitor.name: TagStatsVisitor,
+    StreetNameVisitor.name: StreetNameVisitor,
+    PhoneVisitor.name: PhoneVisitor,
+    MunichNameVisitor.name: MunichNameVisitor,
+}
+
+
+def audit(filename, visitors):
+    """Parse `filename` once and pass every tag to all `visitors`."""
+
+    sys.stderr.write('Audit ' + ', '.join(v.name for v in visitors) + '\n')
+    for elem in parsers.iter_elements(filename, ('node', 'way')):
+        element_id = elem.attrib['id']
+        for tag in elem.iter('tag'):
+            tag_key = to_str(tag.attrib['k'])
+            tag_value = to_str(tag.attrib['v'])
+            for visitor in visitors:
+                visitor.visit_tag(elem.tag, element_id, tag_key, tag_value)
+
+    for visitor in visitors:
+        visitor.finish(filename)
+
+
+def write_reports(visitors, report_dir=REPORT_DIR):
+    """Write the report of each visitor to `<report_dir>/<name>.txt`."""
+
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    for visitor in visitors:
+        path = os.path.join(report_dir, visitor.name + '.txt')
+        with open(path, 'w') as f:
+            visitor.write_report(f)
+        sys.stderr.write('Wrote ' + path + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run several audits of an OSM file in a single pass.')
+    parser.add_argument('filename', help='OSM file')
+    parser.add_argument('--audits', default=','.join(sorted(AUDITS)),
+                        help='comma separated audits (default: all of '
+                             + ', '.join(sorted(AUDITS)) + ')')
+    parser.add_argument('--out-dir', default=REPORT_DIR, dest='out_dir',
+                        help='directory of the reports')
+    args = parser.parse_args()
+
+    names = args.audits.split(',')
+    for name in names:
+        if name not in AUDITS:
+            parser.error('unknown audit: ' + name)
+
+    visitors = [AUDITS[name]() for name in names]
+    audit(args.filename, visitors)
+    write_reports(visitors, args.out_dir)
@@ -1,12 +1,27 @@
 # -*- coding: utf-8 -*-
 """Take phone numbers, check their format and return harmonized form.
+
+`PhoneNormalizer` memoizes the harmonized numbers in a bounded LRU cache,
+as many POIs share the same numbers and formats.
 """
 
 import sys
 import re
+import argparse
+
+from collections import OrderedDict
 
 PHONE_FILE = 'phone-nodes.txt'
 
+# Default number of raw phone numbers kept in the cache of `PhoneNormalizer`
+CACHE_SIZE = 10000
+
+LOCAL_PHONE_NO = re.compile(
+    r'^\(?\+?(00)?(49)?[ 0\-().]*89[ .\-/)]*([)/0-9\-. ]+$)')
+MOBILE_PHONE_NO = re.compile(
+    r'^\(?\+?(00)?(49)?[ 0\-().]*(1[567]\d)[ .\-/)]*([)/0-9\-. ]+$)')
+NON_DIGITS = re.compile(r'[^\d]')
+
 def read_phone_no(phone_file=PHONE_FILE):
     """Read phone numbers from file and return list of phone numbers.
 
@@ -32,16 +47,13 @@ def get_local_phone_no(raw_phone_no):
     """Find and return valid local phone number elements as list.
     Return empty list, if not valid.
     """
-    return re.findall(r'^\(?\+?(00)?(49)?[ 0\-().]*89[ .\-/)]*([)/0-9\-. ]+$)',
-                      raw_phone_no)
+    return LOCAL_PHONE_NO.findall(raw_phone_no)
 
 def get_mobile_phone_no(raw_phone_no):
     """Find and return valid mobile phone number elements as list.
     Return empty list, if not valid.
     """
-    return re.findall(
-        r'^\(?\+?(00)?(49)?[ 0\-().]*(1[567]\d)[ .\-/)]*([)/0-9\-. ]+$)',
-        raw_phone_no)
+    return MOBILE_PHONE_NO.findall(raw_phone_no)
 
 
 def harmonized_local_phone_no(local_phone_no_match):
@@ -50,7 +62,7 @@ def harmonized_local_phone_no(local_phone_no_match):
     """
     actual_phone_no = local_phone_no_match[0][-1]
     clean_phone_no = ' '.join(
-        ['+49 89', re.sub(r'[^\d]', '', actual_phone_no)]
+        ['+49 89', NON_DIGITS.sub('', actual_phone_no)]
         )
     return clean_phone_no
 
@@ -60,8 +72,8 @@ def harmonized_mobile_phone_no(mobile_phone_no_match):
     """
     actual_phone_no = mobile_phone_no_match[0][-1]
     clean_phone_no = ' '.join(
-        ['+49', mobile_phone_no_match[0][-2], re.sub(r'[^\d]', '',
-         actual_phone_no)]
+        ['+49', mobile_phone_no_match[0][-2],
+         NON_DIGITS.sub('', actual_phone_no)]
         )
     return clean_phone_no
 
@@ -80,32 +92,92 @@ def get_clean_phone_no(raw_phone_no):
         str: Harmonized phone number
     """
     local_phone_no_match = get_local_phone_no(raw_phone_no)
-    mobile_phone_no_match = get_mobile_phone_no(raw_phone_no)
-
     if len(local_phone_no_match) > 0:
         return harmonized_local_phone_no(local_phone_no_match)
 
-    elif len(mobile_phone_no_match) > 0:
+    # only try the mobile pattern, if the local one didn't match
+    mobile_phone_no_match = get_mobile_phone_no(raw_phone_no)
+    if len(mobile_phone_no_match) > 0:
         return harmonized_mobile_phone_no(mobile_phone_no_match)
 
     else:
         # sys.stderr.write('Invalid phone#: ' + raw_phone_no + '\n')
         return None
 
-def audit(phone_file=PHONE_FILE):
+
+class PhoneNormalizer(object):
+    """Memoizing wrapper around `get_clean_phone_no`.
+
+    Keeps the results of the last `cache_size` distinct raw phone numbers
+    in an LRU cache and counts cache hits and misses. With a `cache_size`
+    of 0 (or less) nothing is cached.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, raw_phone_no):
+        """Return harmonized phone number or None, if it is not valid."""
+
+        try:
+            clean_phone_no = self.cache.pop(raw_phone_no)
+        except KeyError:
+            self.misses += 1
+            clean_phone_no = get_clean_phone_no(raw_phone_no)
+            if self.cache_size <= 0:
+                return clean_phone_no
+            if len(self.cache) >= self.cache_size:
+                # drop the least recently used number
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+        # (re)insert as most recently used number
+        self.cache[raw_phone_no] = clean_phone_no
+        return clean_phone_no
+
+    def normalize_many(self, raw_phone_nos):
+        """Return list of harmonized phone numbers (or None, if not valid)
+        for the list of raw phone numbers."""
+
+        return [self.normalize(raw_phone_no) for raw_phone_no in raw_phone_nos]
+
+    def clear(self):
+        """Empty the cache and reset the counters."""
+
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def audit(phone_file=PHONE_FILE, cache_size=CACHE_SIZE):
     """Start the phone number audit."""
-    
-    for phone_no in read_phone_no(phone_file):
-        clean_phone_no = get_clean_phone_no(phone_no)
+
+    normalizer = PhoneNormalizer(cache_size)
+    phone_numbers = read_phone_no(phone_file)
+    clean_phone_numbers = normalizer.normalize_many(phone_numbers)
+
+    for phone_no, clean_phone_no in zip(phone_numbers, clean_phone_numbers):
         if clean_phone_no is not None:
             l = len(phone_no)
             print phone_no + ' '*(24-l) + '-->\t' + clean_phone_no
 
-if __name__ == '__main__':
-    if len(sys.argv) is 2:
-        audit(sys.argv[1])
-    elif len(sys.argv) is 1:
-        audit()
-    else:
-        sys.stderr.write('Pleas specify file name or leave blank')
+    sys.stderr.write('Cache hits: {0}, misses: {1}\n'.format(
+        normalizer.hits, normalizer.misses))
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Harmonize the phone numbers of a file.')
+    parser.add_argument('phone_file', nargs='?', default=PHONE_FILE,
+                        help='file with one phone number per line '
+                             '(default: {0})'.format(PHONE_FILE))
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='number of phone numbers kept in the cache '
+                             '(default: {0})'.format(CACHE_SIZE))
+    args = parser.parse_args()
+    if args.cache_size < 0:
+        parser.error('--cache-size must not be negative')
+
+    audit(args.phone_file, args.cache_size)
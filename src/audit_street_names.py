@@ -1,42 +1,67 @@
 # -*- coding: utf-8 -*-
 """Check, if street names are well formed, print bad ones.
 
-Takes an OSM file name as argument and loops over both ways and nodes.
+Takes an OSM (XML or PBF) file name as argument and loops over both ways
+and nodes.
 Each element of type `addr:street` (`is_street_name`) is compared to a
-regular expression. Bad values are stored in the `street_types` array
-and printed in the end.
+regular expression. Bad values are counted in the `street_types` Counter
+and printed in the end, most frequent first, with their count and some
+sample element ids.
 """
 
 import sys
 
 import re
-import xml.etree.cElementTree as ET
 
+from collections import Counter
+
+import parsers
 from util import to_str
 
+# regex including well formed street name patterns
+STREET_NAME_PATTERN = re.compile(
+    r'stra[sß]+e$|weg$|platz$|gasse$|ring$|allee$|anger$|bogen$' +
+    r'|promenade$|^a[nm][-\s]|^i[nm][-\s]|^zu[rm]?[-\s]' +
+    r'|^platz[-\s]|^untere?r?|feld$|hof$|brücke$|garten$|höhe$|insel$',
+    re.IGNORECASE)
+
+# Number of element ids kept per bad street name
+SAMPLE_IDS = 3
+
 def is_street_name(elem):
     """Return true if element is of street type."""
 
     return elem.attrib['k'] == 'addr:street'
 
 
-def audit_street_name(street_types, street_name):
+def audit_street_name(street_types, street_name, sample_ids=None,
+                      element_id=None):
     """Check if street name is a well formed street name.
 
-    Takes an array `street_types` to store bad formed strings.
-    `street_names` is the string which is checked.
+    Takes a Counter `street_types` to count bad formed strings.
+    `street_names` is the string which is checked. If given, up to
+    `SAMPLE_IDS` ids of the elements with a bad street name are added
+    to the list in the dict `sample_ids`.
     """
 
-    # regex including well formed street name patterns
-    regex = (r'stra[sß]+e$|weg$|platz$|gasse$|ring$|allee$|anger$|bogen$' +
-             r'|promenade$|^a[nm][-\s]|^i[nm][-\s]|^zu[rm]?[-\s]' +
-             r'|^platz[-\s]|^untere?r?|feld$|hof$|brücke$|garten$|höhe$|insel$')
-    result = re.compile(regex, re.IGNORECASE).search(street_name)
-
-    if not result and street_name not in street_types:
+    if not STREET_NAME_PATTERN.search(street_name):
         # the regex didn't match the streetname
-        # -> save it as bad one
-        street_types.append(street_name)
+        # -> count it as bad one
+        street_types[street_name] += 1
+        if sample_ids is not None and element_id is not None:
+            ids = sample_ids.setdefault(street_name, [])
+            if len(ids) < SAMPLE_IDS:
+                ids.append(element_id)
+
+
+def sorted_street_types(street_types, sample_ids):
+    """Return list of tuples (street name, count, sample ids),
+    most frequent bad street names first."""
+
+    return [(street_name, count, sample_ids.get(street_name, []))
+            for street_name, count in sorted(street_types.iteritems(),
+                                             key=lambda item: (-item[1],
+                                                               item[0]))]
 
 
 def is_tag_type(elem, tag_type):
@@ -47,28 +72,29 @@ def is_tag_type(elem, tag_type):
 
 def audit(filename):
     """Process the file and do checks.
-    Return an array with bad street names.
+    Return a list of tuples with bad street name, its count and
+    sample element ids, sorted by count.
     """
 
-    iterator = ET.iterparse(filename)
-    street_types = []
+    street_types = Counter()
+    sample_ids = {}
 
-    # iterate over all elements in tree
+    # iterate over all way and node elements (OSM XML or PBF),
+    # parsed elements are removed from memory
     sys.stderr.write("Audit street names:\n\n")
-    for _, elem in iterator:
-        # check if it is either a way or node element
-        if is_tag_type(elem, 'way') or is_tag_type(elem, 'node'):
-            # go through the child elements of the element
-            for tag in elem.iter('tag'):
-                if is_street_name(tag):
-                    # audit the tag
-                    audit_street_name(street_types, to_str(tag.attrib['v']))
+    for elem in parsers.iter_elements(filename, ('node', 'way')):
+        # go through the child elements of the element
+        for tag in elem.iter('tag'):
+            if is_street_name(tag):
+                # audit the tag
+                audit_street_name(street_types, to_str(tag.attrib['v']),
+                                  sample_ids, elem.attrib['id'])
 
-    return street_types
+    return sorted_street_types(street_types, sample_ids)
 
 if __name__ == '__main__':
     if len(sys.argv) is not 2:
         print 'Error! Please provide filename as argument!'
     else:
-        for value in audit(sys.argv[1]):
-            print value
+        for street_name, count, ids in audit(sys.argv[1]):
+            print '{0}\t{1}\t{2}'.format(count, street_name, ','.join(ids))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark for the tag corrections in `check_correct`.
+
+Takes an OSM file name as argument and compares the per-tag cost of the
+former chain of `correct_tag` calls with the rule lookup of
+`correct_node`/`correct_way`.
+
+"Before" is only the former dispatch: every tag runs through all tests of
+the chain. Both variants use the current mapping lookups and phone number
+normalizer, so the difference is the cost of the dispatch alone. The phone
+number cache is emptied before each run, so no run profits from the
+numbers normalized by an earlier one.
+"""
+
+import time
+import argparse
+import xml.etree.cElementTree as ET
+
+import check_correct as CC
+
+REPEAT = 5
+
+
+def read_tags(filename):
+    """Return list of (element type, key, value) of all node and way tags."""
+
+    tags = []
+    for _, elem in ET.iterparse(filename):
+        if elem.tag in ('node', 'way'):
+            for tag in elem.iter('tag'):
+                tags.append((elem.tag, tag.attrib['k'], tag.attrib['v']))
+            elem.clear()
+    return tags
+
+
+def correct_node_chained(tag):
+    """Corrections of a node tag as a chain of `correct_tag` calls."""
+
+    CC.correct_tag(tag, CC.is_city, CC.correct_city_names)
+    CC.correct_tag(tag, CC.is_munich_name, CC.correct_munich_name)
+    CC.correct_tag(tag, CC.is_not_germany, CC.correct_country)
+    CC.correct_tag(tag, CC.is_street_name, CC.correct_street_name)
+    CC.correct_tag(tag, CC.is_phone_no, CC.correct_phone_no)
+
+
+def correct_way_chained(tag):
+    """Corrections of a way tag as a chain of `correct_tag` calls."""
+
+    CC.correct_tag(tag, CC.is_city, CC.correct_city_names)
+    CC.correct_tag(tag, CC.is_street_name, CC.correct_street_name)
+    CC.correct_tag(tag, CC.is_phone_no, CC.correct_phone_no)
+
+
+def time_corrections(tags, correct_node, correct_way, repeat=REPEAT):
+    """Return the best time per tag in seconds over `repeat` runs, each
+    with an empty phone number cache."""
+
+    best = None
+    for _ in range(repeat):
+        CC.PHONE_NORMALIZER.clear()
+        # fresh tag elements, the corrections change them in place
+        elements = [(elem_type, ET.Element('tag', {'k': k, 'v': v}))
+                    for elem_type, k, v in tags]
+        start = time.time()
+        for elem_type, tag in elements:
+            if elem_type == 'node':
+                correct_node(tag)
+            else:
+                correct_way(tag)
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best / max(len(tags), 1)
+
+
+def benchmark(filename):
+    """Run the benchmark and print the per-tag cost."""
+
+    CC.init_values()
+    tags = read_tags(filename)
+
+    before = time_corrections(tags, correct_node_chained, correct_way_chained)
+    after = time_corrections(tags, CC.correct_node, CC.correct_way)
+
+    print 'Tags:\t\t', len(tags)
+    print 'Before:\t\t{0:.3f} us/tag'.format(before * 1e6)
+    print 'After:\t\t{0:.3f} us/tag'.format(after * 1e6)
+    print 'Speedup:\t{0:.1f}x'.format(before / max(after, 1e-12))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the cost of the tag correction dispatch.')
+    parser.add_argument('filename', help='OSM file')
+    args = parser.parse_args()
+
+    benchmark(args.filename)
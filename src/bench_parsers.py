@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the parser backends in `parsers.py`.
+
+Takes an OSM file name as argument (default: `munich_sample.osm`) and prints
+the nodes and ways per second of each available backend for the file type.
+Every element's `tag` and `nd` children are visited, like
+`cleaning.shape_element` does.
+"""
+
+import sys
+import time
+
+import parsers
+
+SAMPLE_FILE = 'munich_sample.osm'
+
+
+def time_parser(filename, parser):
+    """Return tuple of element count and seconds for parsing `filename`."""
+
+    count = 0
+    start = time.time()
+    for element in parsers.iter_elements(filename, ('node', 'way'), parser):
+        for _ in element.iter('tag'):
+            pass
+        for _ in element.iter('nd'):
+            pass
+        count += 1
+    return count, time.time() - start
+
+
+def benchmark(filename=SAMPLE_FILE):
+    """Run the benchmark for all parser backends of the file type and
+    print the results."""
+
+    if parsers.detect_parser(filename) == 'pbf':
+        backends = ['pbf']
+    else:
+        backends = sorted(p for p in parsers.PARSERS if p != 'pbf')
+
+    for parser in backends:
+        try:
+            count, duration = time_parser(filename, parser)
+        except ImportError as e:
+            print '{0}\tskipped ({1})'.format(parser, e)
+            continue
+        print '{0}\t{1} elements in {2:.2f}s\t{3:.0f} elements/s'.format(
+            parser, count, duration, count / max(duration, 1e-6))
+
+if __name__ == '__main__':
+    if len(sys.argv) is 2:
+        benchmark(sys.argv[1])
+    elif len(sys.argv) is 1:
+        benchmark()
+    else:
+        sys.stderr.write('Please specify file name or leave blank\n')
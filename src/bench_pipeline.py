@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the entry points and stages on synthetic OSM files.
+
+For each size a synthetic OSM file is generated with `synthetic_osm.py`
+(kept in the data directory for later runs) and each stage is timed in its
+own process. The elements per second and the peak RSS of the process (or
+of its largest worker process) are printed and appended as one JSON object
+per line to the results file, with the git commit, so runs of different
+commits can be compared.
+
+The stages run in a work directory with links to `audit-mapping` and the
+sql files, so the csv files and databases of the stages don't replace the
+ones in `csv`.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import multiprocessing
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = 'bench-data'
+RESULTS_FILE = 'bench_results.jsonl'
+SIZES = (10000, 100000)
+SEED = 0
+
+# Files and directories of `SRC_DIR`, that the stages read by relative path
+WORK_DIR_LINKS = ('audit-mapping', 'data_wrangling_schema.sql',
+                  'data_wrangling_indexes.sql')
+
+
+#  ================================================== #
+#                Stages                               #
+#  ================================================== #
+# Each stage takes the OSM file name and returns the measured seconds.
+
+def stage_parse(osm_file):
+    import parsers
+
+    start = time.time()
+    for _ in parsers.iter_elements(osm_file):
+        pass
+    return time.time() - start
+
+
+def stage_shape(osm_file):
+    import parsers
+    import cleaning
+    import check_correct as CC
+
+    CC.init_values()
+    start = time.time()
+    for element in parsers.iter_elements(osm_file):
+        cleaning.shape_element(element, as_tuples=True)
+    return time.time() - start
+
+
+def stage_process_map(osm_file):
+    import cleaning
+
+    start = time.time()
+    cleaning.process_map(osm_file, validate=False)
+    return time.time() - start
+
+
+def stage_process_map_parallel(osm_file):
+    import cleaning
+
+    start = time.time()
+    cleaning.process_map(osm_file, validate=False,
+                         workers=multiprocessing.cpu_count())
+    return time.time() - start
+
+
+def stage_process_map_db(osm_file):
+    import cleaning
+
+    start = time.time()
+    cleaning.process_map(osm_file, validate=False, db_path='bench.db')
+    return time.time() - start
+
+
+def stage_geometry(osm_file):
+    import cleaning
+    import geometry
+
+    cleaning.process_map(osm_file, validate=False)
+    start = time.time()
+    geometry.process_geometry_csv()
+    return time.time() - start
+
+
+def stage_explore_audit(osm_file):
+    import explore
+
+    start = time.time()
+    explore.audit(osm_file, 'way')
+    return time.time() - start
+
+
+def stage_explore_audit_stream(osm_file):
+    import explore
+
+    start = time.time()
+    explore.audit_stream(osm_file, 'node')
+    return time.time() - start
+
+
+def stage_audit_street_names(osm_file):
+    import audit_street_names
+
+    start = time.time()
+    audit_street_names.audit(osm_file)
+    return time.time() - start
+
+
+def stage_audit_all(osm_file):
+    import audit_all
+
+    visitors = [audit_all.AUDITS[name]() for name in sorted(audit_all.AUDITS)]
+    start = time.time()
+    audit_all.audit(osm_file, visitors)
+    return time.time() - start
+
+
+STAGES = [
+    ('parse', stage_parse),
+    ('shape', stage_shape),
+    ('process_map', stage_process_map),
+    ('process_map_parallel', stage_process_map_parallel),
+    ('process_map_db', stage_process_map_db),
+    ('geometry', stage_geometry),
+    ('explore.audit', stage_explore_audit),
+    ('explore.audit_stream', stage_explore_audit_stream),
+    ('audit_street_names.audit', stage_audit_street_names),
+    ('audit_all', stage_audit_all),
+]
+
+
+#  ================================================== #
+#                Harness                              #
+#  ================================================== #
+def setup_work_dir(work_dir):
+    """Create `work_dir` with the links and the `csv` directory."""
+
+    if not os.path.isdir(os.path.join(work_dir, 'csv')):
+        os.makedirs(os.path.join(work_dir, 'csv'))
+    for name in WORK_DIR_LINKS:
+        link = os.path.join(work_dir, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(SRC_DIR, name), link)
+
+
+def run_stage_child(conn, stage, osm_file, work_dir):
+    """Run `stage` in the child process, send seconds and peak RSS of
+    the child or, if larger, of one of its worker processes."""
+
+    sys.path.insert(0, SRC_DIR)
+    os.chdir(work_dir)
+    devnull = open(os.devnull, 'w')
+    sys.stdout = sys.stderr = devnull
+    try:
+        seconds = dict(STAGES)[stage](osm_file)
+        # the worker processes of a stage are joined when it ends, so they
+        # are covered by RUSAGE_CHILDREN (the peak of the largest one)
+        rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        conn.send((seconds, rss, None))
+    except Exception as e:
+        conn.send((None, None, '{0}: {1}'.format(type(e).__name__, e)))
+    finally:
+        conn.close()
+
+
+def run_stage(stage, osm_file, work_dir):
+    """Return tuple of seconds, peak RSS (KB on Linux) and error of `stage`
+    run in a new process."""
+
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(
+        target=run_stage_child, args=(sender, stage, osm_file, work_dir))
+    process.start()
+    # only the child keeps the sending end open, so `recv` fails instead of
+    # blocking, if the child dies without a result (e.g. killed when out of
+    # memory)
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        result = (None, None, 'exit code {0}'.format(process.exitcode))
+    return result
+
+
+def get_commit():
+    """Return the current git commit or None."""
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC_DIR,
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_osm_file(size, seed, data_dir):
+    """Return tuple of the synthetic OSM file of `size` elements (generate
+    it, if it does not exist yet) and its element count."""
+
+    import synthetic_osm
+
+    path = os.path.abspath(os.path.join(
+        data_dir, 'synthetic-{0}-{1}.osm'.format(size, seed)))
+    if not os.path.exists(path):
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        sys.stderr.write('Generating {0}\n'.format(path))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            synthetic_osm.write_osm(f, size, seed)
+        os.rename(tmp_path, path)
+    # the generator writes exactly `size` elements for sizes of 2 and more
+    return path, size
+
+
+def benchmark(sizes=SIZES, stages=None, seed=SEED, data_dir=DATA_DIR,
+              results_file=RESULTS_FILE):
+    """Run the `stages` (default: all) for each size, print the results
+    and append them to `results_file`."""
+
+    stages = stages or [name for name, _ in STAGES]
+    commit = get_commit()
+    work_dir = os.path.abspath(os.path.join(data_dir, 'work'))
+    setup_work_dir(work_dir)
+
+    print 'stage\telements\tseconds\telements/s\tpeak RSS (MB)'
+    with open(results_file, 'a') as results:
+        for size in sizes:
+            osm_file, elements = get_osm_file(size, seed, data_dir)
+            for stage in stages:
+                seconds, rss, error = run_stage(stage, osm_file, work_dir)
+                result = {
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'commit': commit,
+                    'python': sys.version.split()[0],
+                    'stage': stage,
+                    'elements': elements,
+                    'file_bytes': os.path.getsize(osm_file),
+                    'seed': seed,
+                    'seconds': seconds,
+                    'elements_per_s': (elements / max(seconds, 1e-6)
+                                       if seconds is not None else None),
+                    'peak_rss_kb': rss,
+                    'error': error,
+                }
+                results.write(json.dumps(result, sort_keys=True) + '\n')
+                results.flush()
+
+                if error is not None:
+                    print '{0}\t{1}\tfailed: {2}'.format(stage, elements,
+                                                         error)
+                else:
+                    print '{0}\t{1}\t{2:.2f}\t{3:.0f}\t{4:.1f}'.format(
+                        stage, elements, seconds, result['elements_per_s'],
+                        rss / 1024.0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the entry points on synthetic OSM files.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='numbers of elements of the synthetic files '
+                             '(default: {0})'.format(
+                                 ' '.join(str(s) for s in SIZES)))
+    parser.add_argument('--stages', nargs='+',
+                        choices=[name for name, _ in STAGES],
+                        help='stages to run (default: all)')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed of the synthetic files (default: 0)')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help='directory of the synthetic files '
+                             '(default: {0})'.format(DATA_DIR))
+    parser.add_argument('--out', dest='results_file', default=RESULTS_FILE,
+                        help='results file, JSON lines '
+                             '(default: {0})'.format(RESULTS_FILE))
+    args = parser.parse_args()
+
+    benchmark(args.sizes, args.stages, args.seed, args.data_dir,
+              args.results_file)
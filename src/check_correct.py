@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 """Functions for checking and correcting Munich OSM data.
 Before using this module, it `init_values()` has to be used to read external
-data and assing it to global variables. Afterwards, `correct_node(tag)` and
-`correct_way(tag)` check a given tag and corrects it (in place), if necessary.
+data and assing it to global variables. Afterwards, `correct_node(tag)`,
+`correct_way(tag)` and `correct_relation(tag)` check a given tag and corrects
+it (in place), if necessary.
+
+The corrections are looked up by tag key in `NODE_RULES` and `WAY_RULES`,
+which are built by `init_values()`. Tags with other keys are left untouched
+without further checks.
+
+The corrections are counted in the `CorrectionLog` `CORRECTIONS`, with
+`init_values(verbose=True)` they are printed as well.
 """
 
-from util import to_str
-from audit_phone_no import get_clean_phone_no
+from util import to_str, to_unicode
+from audit_phone_no import PhoneNormalizer, CACHE_SIZE as PHONE_CACHE_SIZE
+from correction_log import CorrectionLog
 
 MUNICH_NAMES_FILE = 'audit-mapping/munich-names.txt'
 CITY_FILE = 'audit-mapping/city-names.txt'
@@ -17,10 +26,14 @@ GOOD_MUNICH = 'München'
 COUNTRY_DE = 'DE'
 PHONE_TAG = 'phone'
 
-MUNICH_NAMES = []
+MUNICH_NAMES = frozenset()
 CITY_DICT = {}
 STREET_DICT = {}
+PHONE_NORMALIZER = None
+CORRECTIONS = CorrectionLog()
 
+NODE_RULES = {}
+WAY_RULES = {}
 
 
 # --- Utility Functions ---
@@ -35,17 +48,33 @@ def get_key_value_of_tag(tag):
     return tag_key, tag_value
 
 
+def read_mapping(mapping_file):
+    """Return a dict from a file with one `original:substitution` pair
+    per line. Line breaks are removed, other whitespace is kept, as it can
+    be part of the original value.
+    """
+
+    mapping = {}
+    with open(mapping_file) as f:
+        for line in f:
+            names = line.rstrip('\r\n').split(':', 1)
+            if len(names) > 1:
+                mapping[to_str(names[0])] = names[1]
+    return mapping
+
+
+def set_value(tag, value):
+    """Set the value of `tag`. The value is stored as unicode, which all
+    parser backends accept for non-ascii characters."""
+
+    tag.attrib['v'] = to_unicode(value)
+
+
 def get_city_dict(city_file=CITY_FILE):
     """Return a dict including dublicate cities,
     with original city name as key and substitution name as value."""
 
-    city_dict = {}
-    with open(city_file) as f:
-        for line in f:
-            city_names = line.split(':')
-            if len(city_names) > 1:
-                city_dict[to_str(city_names[0])] = city_names[1]
-    return city_dict
+    return read_mapping(city_file)
 
 
 def get_street_names_dict(street_file=STREET_FILE):
@@ -53,24 +82,15 @@ def get_street_names_dict(street_file=STREET_FILE):
     including the original street name as key and substitution as value.
     """
 
-    street_names_dict = {}
-    with open(street_file) as f:
-        for line in f:
-            street_names = line.split(':')
-            if len(street_names) > 1:
-                street_names_dict[to_str(street_names[0])] = street_names[1]
-    return street_names_dict
+    return read_mapping(street_file)
 
 
 
 def get_munich_names(munich_file=MUNICH_NAMES_FILE):
-    """Load Munich names from file."""
+    """Load Munich names from file and return them as frozenset."""
 
-    munich_names = []
     with open(munich_file) as f:
-        for line in f:
-            munich_names.append(line.strip())
-    return munich_names
+        return frozenset(line.strip() for line in f if line.strip())
 
 # --- Checks ---
 # ////////////////////////////////////////////////////////////////////
@@ -94,6 +114,16 @@ def is_not_germany(tag):
 
     return tag_key == 'addr:country' and (country != COUNTRY_DE)
 
+def is_munich_value(city_name):
+    """Return True if `city_name` is one of the Munich name variants."""
+
+    return city_name in MUNICH_NAMES
+
+def is_not_germany_value(country):
+    """Return True if `country` is not `DE`."""
+
+    return country != COUNTRY_DE
+
 # Way related
 # ------------
 
@@ -130,14 +160,18 @@ def is_phone_no(tag):
 def correct_munich_name(tag):
     """Replace the value of `tag` with the correct Munich name."""
 
-    tag.attrib['v'] = GOOD_MUNICH
+    city_name_og = to_str(tag.attrib['v'])
+    if city_name_og != GOOD_MUNICH:
+        CORRECTIONS.record('munich', city_name_og, GOOD_MUNICH)
+    set_value(tag, GOOD_MUNICH)
     return tag
 
 
 def correct_country(tag):
     """Replace the value of `tag` with the correct German symbol."""
 
-    tag.attrib['v'] = COUNTRY_DE
+    CORRECTIONS.record('country', to_str(tag.attrib['v']), COUNTRY_DE)
+    set_value(tag, COUNTRY_DE)
     return tag
 
 # Way related
@@ -146,11 +180,11 @@ def correct_country(tag):
 def correct_city_names(tag):
     """Replace duplicate cities with uniqe city name."""
 
-    city_dict = CITY_DICT
     city_name_og = to_str(tag.attrib['v'])
-    if city_name_og in city_dict.keys():
-        tag.attrib['v'] = city_dict[city_name_og]
-        print 'Change City:', city_name_og, ' => ', city_dict[city_name_og]
+    city_name = CITY_DICT.get(city_name_og)
+    if city_name is not None:
+        set_value(tag, city_name)
+        CORRECTIONS.record('city', city_name_og, city_name)
     return tag
 
 # Node & Way related
@@ -161,12 +195,11 @@ def correct_street_name(tag):
     correct them, if necessary.
     """
 
-    street_names_dict = STREET_DICT
     street_name_og = to_str(tag.attrib['v'])
-    if street_name_og in street_names_dict.keys():
-        tag.attrib['v'] = street_names_dict[street_name_og]
-        print 'Change Street:', street_name_og, ' => ' + \
-                street_names_dict[street_name_og]
+    street_name = STREET_DICT.get(street_name_og)
+    if street_name is not None:
+        set_value(tag, street_name)
+        CORRECTIONS.record('street', street_name_og, street_name)
     return tag
 
 def correct_phone_no(tag):
@@ -174,14 +207,16 @@ def correct_phone_no(tag):
     harmonized ones.
     """
     _, raw_phone_no = get_key_value_of_tag(tag)
-    clean_phone_no = get_clean_phone_no(raw_phone_no)
+    clean_phone_no = PHONE_NORMALIZER.normalize(raw_phone_no)
     if clean_phone_no is not None:
-        print 'Change phone#:', raw_phone_no, '=>', clean_phone_no
-        tag.attrib['v'] = clean_phone_no
+        if clean_phone_no != raw_phone_no:
+            CORRECTIONS.record('phone', raw_phone_no, clean_phone_no)
+        set_value(tag, clean_phone_no)
     else:
-        print 'Bad phone# format:', raw_phone_no, 'make `phone_bad` tag'
+        # the tag is renamed to `phone_bad`, the value is kept
+        CORRECTIONS.record('phone_bad', raw_phone_no, None)
         tag.attrib['k'] = 'phone_bad'
-        tag.attrib['v'] = raw_phone_no
+        set_value(tag, raw_phone_no)
 
 # --- Major correct handler ---
 # ////////////////////////////////////////////////////////////////////
@@ -196,33 +231,78 @@ def correct_tag(tag, test_f, correct_f):
         correct_f(tag)
     return tag
 
+def correct_by_rules(tag, rules):
+    """Look up the rules for the key of `tag` and apply them in order.
+
+    `rules` maps tag keys to lists of (value test, correct function) pairs.
+    The correct function is called, if the test is None or returns True
+    for the current tag value. Return corrected tag.
+    """
+
+    tag_rules = rules.get(tag.attrib['k'])
+    if tag_rules is not None:
+        for test_f, correct_f in tag_rules:
+            if test_f is None or test_f(to_str(tag.attrib['v'])):
+                correct_f(tag)
+    return tag
+
 def correct_node(tag):
     """Fires all checks and corrections for the given node `tag`."""
 
-    correct_tag(tag, is_city, correct_city_names)
-    correct_tag(tag, is_munich_name, correct_munich_name)
-    correct_tag(tag, is_not_germany, correct_country)
-    correct_tag(tag, is_street_name, correct_street_name)
-    correct_tag(tag, is_phone_no, correct_phone_no)
+    correct_by_rules(tag, NODE_RULES)
 
 def correct_way(tag):
     """Fires all checks and corrections for the given way `tag`."""
 
-    correct_tag(tag, is_city, correct_city_names)
-    correct_tag(tag, is_street_name, correct_street_name)
-    correct_tag(tag, is_phone_no, correct_phone_no)
+    correct_by_rules(tag, WAY_RULES)
+
+def correct_relation(tag):
+    """Fires all checks and corrections for the given relation `tag`.
+    Relations (e.g. multipolygon buildings) get the corrections of ways."""
+
+    correct_by_rules(tag, WAY_RULES)
+
+def get_node_rules():
+    """Return the correction rules for node tags, keyed by tag key."""
+
+    return {
+        CITY_TAG: [(None, correct_city_names),
+                   (is_munich_value, correct_munich_name)],
+        'addr:country': [(is_not_germany_value, correct_country)],
+        STREET_TAG: [(None, correct_street_name)],
+        PHONE_TAG: [(None, correct_phone_no)],
+    }
+
+def get_way_rules():
+    """Return the correction rules for way tags, keyed by tag key."""
+
+    return {
+        CITY_TAG: [(None, correct_city_names)],
+        STREET_TAG: [(None, correct_street_name)],
+        PHONE_TAG: [(None, correct_phone_no)],
+    }
 
 # --- Initialize Globals ---
 # ////////////////////////////////////////////////////////////////////
 
-def init_values():
+def init_values(verbose=False, phone_cache_size=PHONE_CACHE_SIZE):
     """Init the global variables.
-    Needs to be called before other functions are used."""
+    Needs to be called before other functions are used.
+    With `verbose=True` each correction is printed. `phone_cache_size` is
+    the number of raw phone numbers kept in the cache of the normalizer."""
 
     global MUNICH_NAMES
     global CITY_DICT
     global STREET_DICT
+    global PHONE_NORMALIZER
+    global CORRECTIONS
+    global NODE_RULES
+    global WAY_RULES
 
     MUNICH_NAMES = get_munich_names()
     CITY_DICT = get_city_dict()
     STREET_DICT = get_street_names_dict()
+    PHONE_NORMALIZER = PhoneNormalizer(phone_cache_size)
+    CORRECTIONS = CorrectionLog(verbose)
+    NODE_RULES = get_node_rules()
+    WAY_RULES = get_way_rules()
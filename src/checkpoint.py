@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of `cleaning.process_map`, to resume a failed run.
+
+With checkpoints the OSM file is processed in shards (see `sharding.py`) of
+about `CHECKPOINT_BYTES`. After each shard the csv files are flushed and the
+checkpoint is saved as JSON: the input file, the byte offset of the next
+shard, the type and id of the last element and the absolute path, size
+and modification time of each csv file. A resumed run checks, that the csv
+files were not replaced or shortened since, truncates them to these sizes
+and continues at the offset, so the result is the same as the one of an
+uninterrupted run.
+"""
+
+import os
+import json
+
+# Input bytes between two checkpoints
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+
+def get_file_info(filename):
+    """Return dict that identifies the file `filename`."""
+
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': stat.st_size,
+            'mtime': int(stat.st_mtime)}
+
+
+def sync_files(files):
+    """Flush the opened `files` to disk and return list of their file
+    infos (see `get_file_info`)."""
+
+    outputs = []
+    for f in files:
+        f.flush()
+        os.fsync(f.fileno())
+        outputs.append(get_file_info(f.name))
+    return outputs
+
+
+def save(path, file_in, offset, last_element, outputs):
+    """Save checkpoint at byte `offset` of `file_in`, after the element
+    (type, id) `last_element`, with the list of file infos `outputs`.
+    The file is replaced atomically."""
+
+    state = {
+        'input': get_file_info(file_in),
+        'offset': offset,
+        'last_element': last_element,
+        'outputs': outputs,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def load(path, file_in):
+    """Return the checkpoint at `path` as dict. Raise ValueError, if it
+    was saved for another or a changed input file, or if an output file is
+    missing, shorter or older than at the checkpoint."""
+
+    with open(path) as f:
+        state = json.load(f)
+    # compare the JSON form, paths are loaded as unicode
+    if state['input'] != json.loads(json.dumps(get_file_info(file_in))):
+        raise ValueError('Checkpoint {0} does not belong to {1} (or the file '
+                         'has changed)'.format(path, file_in))
+    for output in state['outputs']:
+        # the run went on after the checkpoint, so the files may have grown
+        if not os.path.exists(output['path']):
+            raise ValueError('Output {0} of checkpoint {1} is missing'.format(
+                output['path'], path))
+        info = get_file_info(output['path'])
+        if info['size'] < output['size'] or info['mtime'] < output['mtime']:
+            raise ValueError('Output {0} has changed since checkpoint '
+                             '{1}'.format(output['path'], path))
+    return state
+
+
+def truncate_outputs(outputs):
+    """Truncate the output files to the sizes of the checkpoint."""
+
+    for output in outputs:
+        with open(output['path'], 'r+b') as f:
+            f.truncate(output['size'])
+
+
+def remove(path):
+    """Remove the checkpoint, e.g. after a completed run."""
+
+    if os.path.exists(path):
+        os.remove(path)
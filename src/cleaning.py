@@ -5,22 +5,45 @@ Source code by Udacity (Data Analyst Nanodegree - P3: Wrangle OpenStreetMap Data
 Adapted by Moritz Biersack for 'OpenStreetMap Data Munich'
 """
 
+import os
 import sys
 import csv
+import time
 import codecs
 import re
-import xml.etree.cElementTree as ET
-
+import shutil
+import cProfile
+import tempfile
+import argparse
+import multiprocessing
 import cerberus
+from itertools import count, izip, repeat
+from cStringIO import StringIO
 
 import schema
+import parsers
+import compressed
+import sharding
+import checkpoint
 import check_correct as CC
+import geometry
+from sqlite_sink import SqliteSink
+from parquet_sink import ParquetSink
+from validation import FastValidator
+from correction_log import CorrectionLog
+from run_stats import RunStats, file_position
+from records import Way, node_id_array
+from util import to_str
 
 NODES_PATH = "csv/nodes.csv"
 NODE_TAGS_PATH = "csv/nodes_tags.csv"
 WAYS_PATH = "csv/ways.csv"
 WAY_NODES_PATH = "csv/ways_nodes.csv"
 WAY_TAGS_PATH = "csv/ways_tags.csv"
+RELATIONS_PATH = "csv/relations.csv"
+RELATION_MEMBERS_PATH = "csv/relations_members.csv"
+RELATION_TAGS_PATH = "csv/relations_tags.csv"
+CHECKPOINT_PATH = "csv/checkpoint.json"
 
 PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%# $@\,\. \t\r\n]')
 
@@ -34,9 +57,46 @@ NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'member_type', 'role',
+                           'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+
+CSV_PATHS = (NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH,
+             WAY_TAGS_PATH, RELATIONS_PATH, RELATION_MEMBERS_PATH,
+             RELATION_TAGS_PATH)
+CSV_FIELDS = (NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS,
+              WAY_TAGS_FIELDS, RELATION_FIELDS, RELATION_MEMBERS_FIELDS,
+              RELATION_TAGS_FIELDS)
+
+# Fields of the rows of shaped elements, by key
+SHAPE_FIELDS = {
+    'node': NODE_FIELDS,
+    'node_tags': NODE_TAGS_FIELDS,
+    'way': WAY_FIELDS,
+    'way_nodes': WAY_NODES_FIELDS,
+    'way_tags': WAY_TAGS_FIELDS,
+    'relation': RELATION_FIELDS,
+    'relation_members': RELATION_MEMBERS_FIELDS,
+    'relation_tags': RELATION_TAGS_FIELDS,
+}
+
+# Top level elements written by `process_map`
+ELEMENT_TAGS = ('node', 'way', 'relation')
+
+# Bytes of csv rows buffered per file before they are written
+CSV_BUFFER_SIZE = 256 * 1024
+
+# Number of shards per worker process in parallel mode. More shards than
+# workers keep all processes busy, if some parts of the file are denser.
+SHARDS_PER_WORKER = 4
+
+
+def iter_tags(element, tags, problem_chars, element_tag_type,
+              as_tuples=False):
+    # sample element ids of the correction log
+    CC.CORRECTIONS.element_id = element.attrib['id']
 
-
-def iter_tags(element, tags, problem_chars, element_tag_type):
     for tag in element.iter("tag"):
         tag_key = tag.attrib['k']
 
@@ -48,6 +108,8 @@ def iter_tags(element, tags, problem_chars, element_tag_type):
             CC.correct_node(tag)
         if element_tag_type == "way":
             CC.correct_way(tag)
+        if element_tag_type == "relation":
+            CC.correct_relation(tag)
 
         # update tag key 
         tag_key = tag.attrib['k']
@@ -62,6 +124,11 @@ def iter_tags(element, tags, problem_chars, element_tag_type):
             tag_key = ':'.join(s[1:])
             tag_type = s[0]
 
+        if as_tuples:
+            tags.append((element.attrib['id'], tag_key, tag.attrib['v'],
+                         tag_type))
+            continue
+
         tags.append({
             'key': tag_key,
             'id': element.attrib['id'],
@@ -70,8 +137,15 @@ def iter_tags(element, tags, problem_chars, element_tag_type):
             })
 
 def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict"""
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular',
+                  relation_attr_fields=RELATION_FIELDS, as_tuples=False):
+    """Clean and shape node, way or relation XML element to Python dict.
+
+    With `as_tuples=True` the rows are tuples in the order of the fields
+    (e.g. `NODE_FIELDS`) instead of dicts, missing attributes are None.
+    The node refs of ways are kept in a `records.Way`. The sinks take this
+    form, see `element_to_dict` for the conversion.
+    """
 
     node_attribs = {}
     way_attribs = {}
@@ -86,7 +160,11 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 node_attribs[key] = value
 
         #  node children tags
-        iter_tags(element, tags, problem_chars, "node")
+        iter_tags(element, tags, problem_chars, "node", as_tuples)
+
+        if as_tuples:
+            return {'node': tuple(map(element.attrib.get, node_attr_fields)),
+                    'node_tags': tags}
 
         r_node = {'node': node_attribs, 'node_tags': tags}
         return r_node
@@ -98,7 +176,14 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 way_attribs[key] = value
 
         #  way children tags
-        iter_tags(element, tags, problem_chars, "way")
+        iter_tags(element, tags, problem_chars, "way", as_tuples)
+
+        if as_tuples:
+            node_ids = node_id_array(map(int, [
+                nd.attrib['ref'] for nd in element.iter("nd")]))
+            return {'way': tuple(map(element.attrib.get, way_attr_fields)),
+                    'way_nodes': Way(element.attrib['id'], node_ids),
+                    'way_tags': tags}
 
         #  way children nd elements
         for i, nd in enumerate(element.iter("nd")):
@@ -111,19 +196,52 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
         r_way = {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
         return r_way
 
+    elif element.tag == 'relation':
+        #  relation attributes
+        relation_attribs = {}
+        for key, value in element.attrib.iteritems():
+            if key in relation_attr_fields:
+                relation_attribs[key] = value
+
+        #  relation children tags
+        iter_tags(element, tags, problem_chars, "relation", as_tuples)
+
+        if as_tuples:
+            relation_id = element.attrib['id']
+            return {'relation': tuple(map(element.attrib.get,
+                                          relation_attr_fields)),
+                    'relation_members': [
+                        (relation_id, member.attrib['ref'],
+                         member.attrib['type'], member.attrib.get('role', ''),
+                         i)
+                        for i, member in enumerate(element.iter("member"))],
+                    'relation_tags': tags}
+
+        #  relation children member elements
+        members = []
+        for i, member in enumerate(element.iter("member")):
+            members.append({
+                'id': element.attrib['id'],
+                'member_id': member.attrib['ref'],
+                'member_type': member.attrib['type'],
+                'role': member.attrib.get('role', ''),
+                'position': i
+                })
+
+        return {'relation': relation_attribs, 'relation_members': members,
+                'relation_tags': tags}
+
 
 #  ================================================== # 
 #                Helper Functions                     # 
 #  ================================================== # 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_element(osm_file, tags=('node', 'way', 'relation'), parser=None,
+                workers=1):
+    """Yield element if it is the right type of tag.
+    `parser` selects the backend (see `parsers.PARSERS`), by default the one
+    for the file type. `workers` processes decode PBF files."""
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    return parsers.iter_elements(osm_file, tags, parser, workers)
 
 
 def validate_element(element, validator, schema=SCHEMA):
@@ -140,68 +258,606 @@ def validate_element(element, validator, schema=SCHEMA):
         )
 
 
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
+def element_to_dict(el):
+    """Return shaped element `el` with tuple rows (see `shape_element`)
+    with dict rows instead, e.g. for validation."""
+
+    result = {}
+    for key, rows in el.iteritems():
+        fields = SHAPE_FIELDS[key]
+        if key in ELEMENT_TAGS:
+            rows = [rows]
+        rows = [dict((field, value) for field, value in zip(fields, row)
+                     if value is not None)
+                for row in rows]
+        result[key] = rows[0] if key in ELEMENT_TAGS else rows
+    return result
+
+
+class TupleCsvWriter(object):
+    """Write rows as tuples (in the order of `fields`) to csv file `f`.
+
+    Unicode values are encoded as utf-8. The rows are collected in a buffer,
+    that is written to `f` at once, when it exceeds `buffer_size` bytes.
+    """
+
+    def __init__(self, f, fields, buffer_size=CSV_BUFFER_SIZE):
+        self.f = f
+        self.fields = fields
+        self.buffer_size = buffer_size
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def writeheader(self):
+        self.writer.writerow(self.fields)
 
     def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems()
-        })
+        self.writer.writerow([v.encode('utf-8') if type(v) is unicode else v
+                              for v in row])
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
 
     def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+        self.writer.writerows([[v.encode('utf-8') if type(v) is unicode
+                                else v for v in row] for row in rows])
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+
+    def write_way_nodes(self, way):
+        """Write the `ways_nodes` rows of `records.Way` `way` at once,
+        without building a tuple per row first."""
+
+        self.writer.writerows(izip(repeat(to_str(way.id)), way.node_ids,
+                                   count()))
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows to the file."""
+
+        self.f.write(self.buffer.getvalue())
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer)
+
+
+class CsvSink(object):
+    """Write shaped elements with tuple rows to the csv files in `paths`
+    (see `CSV_PATHS`). Use `mode='a'` to append to existing files."""
+
+    def __init__(self, paths=CSV_PATHS, header=True, mode='w'):
+        self.files = [codecs.open(path, mode) for path in paths]
+        self.writers = [TupleCsvWriter(f, fields)
+                        for f, fields in zip(self.files, CSV_FIELDS)]
+
+        (self.nodes_writer, self.node_tags_writer, self.ways_writer,
+         self.way_nodes_writer, self.way_tags_writer, self.relations_writer,
+         self.relation_members_writer,
+         self.relation_tags_writer) = self.writers
+
+        if header:
+            self.nodes_writer.writeheader()
+            self.node_tags_writer.writeheader()
+            self.ways_writer.writeheader()
+            self.way_nodes_writer.writeheader()
+            self.way_tags_writer.writeheader()
+            self.relations_writer.writeheader()
+            self.relation_members_writer.writeheader()
+            self.relation_tags_writer.writeheader()
+
+    def write_node(self, el):
+        self.nodes_writer.writerow(el['node'])
+        self.node_tags_writer.writerows(el['node_tags'])
+
+    def write_way(self, el):
+        self.ways_writer.writerow(el['way'])
+        self.way_nodes_writer.write_way_nodes(el['way_nodes'])
+        self.way_tags_writer.writerows(el['way_tags'])
+
+    def write_relation(self, el):
+        self.relations_writer.writerow(el['relation'])
+        self.relation_members_writer.writerows(el['relation_members'])
+        self.relation_tags_writer.writerows(el['relation_tags'])
+
+    def flush(self):
+        """Write all buffered rows to disk. Return list of (path, size) of
+        the csv files."""
+
+        for writer in self.writers:
+            writer.flush()
+        return checkpoint.sync_files(self.files)
+
+    def close(self):
+        for writer in self.writers:
+            writer.flush()
+        for f in self.files:
+            f.close()
 
 
 #  ================================================== #
 #                Main Function                        #
 #  ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    CC.init_values()
-
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-         codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-         codecs.open(WAYS_PATH, 'w') as ways_file, \
-         codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-         codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
+def write_elements(elements, sink, validate=False, fast_validator=None,
+                   stats=None):
+    """Shape each XML element and write it to `sink`.
+    Violations found by the optional `fast_validator` are collected in it.
+    If `stats` (`run_stats.RunStats`) is given, the stages are timed."""
 
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
+    if stats is not None:
+        write_elements_timed(elements, sink, stats, validate, fast_validator)
+        return
 
-        validator = cerberus.Validator()
+    validator = cerberus.Validator()
 
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
+    try:
+        for element in elements:
+            el = shape_element(element, as_tuples=True)
             if el:
                 if validate is True:
                     # pass
-                    validate_element(el, validator)
+                    validate_element(element_to_dict(el), validator)
+                if fast_validator is not None:
+                    fast_validator.validate(el)
 
                 if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
+                    sink.write_node(el)
                 elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+                    sink.write_way(el)
+                elif element.tag == 'relation':
+                    sink.write_relation(el)
+    finally:
+        sink.close()
+
+
+def write_elements_timed(elements, sink, stats, validate=False,
+                         fast_validator=None):
+    """`write_elements` with the stages timed and counted in `stats`."""
+
+    validator = cerberus.Validator()
+    times = stats.times
+    clock = time.time
+    writers = {'node': sink.write_node, 'way': sink.write_way,
+               'relation': sink.write_relation}
+
+    stats.start_correct_timer()
+    try:
+        elements = iter(elements)
+        while True:
+            start = clock()
+            element = next(elements, None)
+            parsed = clock()
+            times['parse'] += parsed - start
+            if element is None:
+                break
+
+            el = shape_element(element, as_tuples=True)
+            shaped = clock()
+            times['shape'] += shaped - parsed
+            if el:
+                if validate is True:
+                    validate_element(element_to_dict(el), validator)
+                if fast_validator is not None:
+                    fast_validator.validate(el)
+                validated = clock()
+                times['validate'] += validated - shaped
+
+                if element.tag in writers:
+                    writers[element.tag](el)
+                    stats.add_element(element.tag, el)
+                shaped = clock()
+                times['write'] += shaped - validated
+            stats.progress(shaped)
+    finally:
+        stats.stop_correct_timer()
+        start = clock()
+        sink.close()
+        times['write'] += clock() - start
+
+
+def write_validation_report(fast_validator, report_path=None):
+    """Write the violations to `report_path` or stderr."""
+
+    if report_path is None:
+        fast_validator.write_report(sys.stderr)
+    else:
+        with open(report_path, 'w') as f:
+            fast_validator.write_report(f)
+
+
+def track_last_element(elements, last):
+    """Yield `elements` and keep the type and id of the latest one in the
+    list `last`."""
+
+    for element in elements:
+        last[:] = element.tag, element.attrib['id']
+        yield element
+
+
+class CheckpointedInput(object):
+    """Iterable of the elements of the OSM file `file_in` from byte
+    `offset` on, read in shards of about `checkpoint.CHECKPOINT_BYTES`.
+    After each shard the csv files of `sink` are flushed and the checkpoint
+    is saved to `path`. `tell` returns the bytes read, like a file."""
+
+    def __init__(self, file_in, parser, sink, offset=0,
+                 path=CHECKPOINT_PATH):
+        self.file_in = file_in
+        self.parser = parser
+        self.sink = sink
+        self.offset = offset
+        self.path = path
+        self.reader = None
+
+    def tell(self):
+        if self.reader is not None:
+            return self.reader.tell()
+        return self.offset
+
+    def __iter__(self):
+        count = max(1, (os.path.getsize(self.file_in) - self.offset) //
+                    checkpoint.CHECKPOINT_BYTES)
+        last = []
+        for start, end in sharding.get_shards(self.file_in, count,
+                                              self.offset):
+            self.reader = sharding.ShardReader(self.file_in, start, end)
+            try:
+                for element in track_last_element(get_element(
+                        self.reader, ELEMENT_TAGS, self.parser), last):
+                    yield element
+            finally:
+                self.reader.close()
+                self.reader = None
+
+            # all elements of the shard are written, when the next one is
+            # requested
+            self.offset = end
+            checkpoint.save(self.path, self.file_in, end, last,
+                            self.sink.flush())
+
+
+def resume_offset(file_in, resume, path=CHECKPOINT_PATH):
+    """Return the byte offset of the checkpoint at `path` and truncate the
+    csv files to it, if `resume` is True and there is one, otherwise 0."""
+
+    if not resume or not os.path.exists(path):
+        return 0
+    state = checkpoint.load(path, file_in)
+    checkpoint.truncate_outputs(state['outputs'])
+    sys.stderr.write('Resume after {0} {1} at byte {2}\n'.format(
+        state['last_element'][0], state['last_element'][1], state['offset'])
+        if state['last_element'] else
+        'Resume at byte {0}\n'.format(state['offset']))
+    return state['offset']
+
+
+def write_correction_report(corrections, corrections_path=None):
+    """Write the number of corrections per rule to stderr and all
+    corrections to `corrections_path` (CSV, or JSON for `.json`)."""
+
+    corrections.write_summary(sys.stderr)
+    if corrections_path is not None:
+        corrections.write_report(corrections_path)
+
+
+def process_map(file_in, validate, workers=1, db_path=None,
+                validate_every=None, report_path=None, parser=None,
+                parquet_dir=None, stats=False, corrections_path=None,
+                verbose=False, checkpoints=False, resume=False,
+                phone_cache_size=CC.PHONE_CACHE_SIZE):
+    """Iteratively process each XML element and write to csv(s).
+    If `db_path` is given, load the elements into this SQLite database
+    instead. If `parquet_dir` is given, write Parquet files to this
+    directory instead (needs pyarrow). Both need a single worker, unless
+    the file can not be split into shards anyway.
+
+    With `validate_every=N` every Nth element is checked by the fast
+    validator and the violations are written to `report_path` (or stderr).
+    `parser` selects the parser backend (see `parsers.PARSERS`), by default
+    the one for the file type. PBF files are not split into shards, the
+    `workers` decode their blobs instead. Compressed XML files can not be
+    split either and are processed by a single worker.
+
+    With `stats=True` the time of each stage, the element and tag counts
+    and the progress are written to stderr (see `run_stats.py`).
+    The corrections are counted and written to `corrections_path`, with
+    `verbose=True` each one is printed. `phone_cache_size` sets the cache
+    of the phone number normalizer (see `check_correct.init_values`).
+
+    With `checkpoints=True` a checkpoint is saved to `CHECKPOINT_PATH`
+    regularly (see `checkpoint.py`), csv output and an uncompressed XML file
+    are needed. With `resume=True` the run continues at the checkpoint of a
+    failed one, if there is one. The reports then cover only the rest of
+    the file.
+    """
+
+    parser = parsers.detect_parser(file_in, parser)
+    if (db_path is not None or parquet_dir is not None) and workers > 1 and \
+            can_shard(file_in, parser):
+        raise ValueError('SQLite and Parquet output need a single worker')
+    checkpoints = checkpoints or resume
+    if checkpoints and (db_path is not None or parquet_dir is not None or
+                        not can_shard(file_in, parser)):
+        raise ValueError('Checkpoints need csv output and an uncompressed '
+                         'XML file')
+    if not resume and db_path is None and parquet_dir is None:
+        # the csv files are rewritten, an old checkpoint does not fit them
+        checkpoint.remove(CHECKPOINT_PATH)
+    offset = resume_offset(file_in, resume)
+
+    if workers > 1 and can_shard(file_in, parser):
+        process_map_parallel(file_in, validate, workers, validate_every,
+                             report_path, parser, stats, corrections_path,
+                             verbose, checkpoints, offset, phone_cache_size)
+        return
+
+    CC.init_values(verbose, phone_cache_size)
+    if db_path is not None:
+        sink = SqliteSink(db_path)
+    elif parquet_dir is not None:
+        sink = ParquetSink(parquet_dir)
+    elif offset:
+        sink = CsvSink(header=False, mode='a')
+    else:
+        sink = CsvSink()
+    fast_validator = None
+    if validate_every is not None:
+        fast_validator = FastValidator(every=validate_every,
+                                       prepare=element_to_dict)
+
+    if checkpoints:
+        source = CheckpointedInput(file_in, parser, sink, offset)
+        run_stats = None
+        if stats:
+            run_stats = RunStats(os.path.getsize(file_in), source.tell)
+        write_elements(source, sink, validate, fast_validator, run_stats)
+        if run_stats is not None:
+            run_stats.write_report(sys.stderr)
+        checkpoint.remove(CHECKPOINT_PATH)
+    elif stats:
+        # the file is opened here to show the bytes read in the progress
+        source = compressed.open_input(file_in)
+        run_stats = RunStats(os.path.getsize(file_in),
+                             lambda: file_position(source))
+        try:
+            write_elements(get_element(source, ELEMENT_TAGS, parser, workers),
+                           sink, validate, fast_validator, run_stats)
+            run_stats.write_report(sys.stderr)
+        finally:
+            source.close()
+    else:
+        write_elements(get_element(file_in, ELEMENT_TAGS, parser, workers),
+                       sink, validate, fast_validator)
 
+    write_correction_report(CC.CORRECTIONS, corrections_path)
+    if fast_validator is not None:
+        write_validation_report(fast_validator, report_path)
 
-if __name__ == '__main__':
-    #  Note: Validation is ~ 10X slower. For the project consider using a small
-    #  sample of the map when validating.
 
-    if len(sys.argv) is not 2:
-        print 'Error! Please provide filname as argument'
-    else:
-        process_map(sys.argv[1], validate=False)
+#  ================================================== #
+#                Parallel Processing                  #
+#  ================================================== #
+def can_shard(file_in, parser):
+    """Return True if `file_in` can be split into shards of XML."""
+
+    return parser != 'pbf' and not compressed.is_compressed(file_in)
+
+
+def process_shard(job):
+    """Process one shard of the OSM file in a worker process.
+
+    Takes a tuple of file name, start and end byte of the shard, the csv
+    paths of the shard, the validate flag, the fast validation interval,
+    the parser backend and the stats flag.
+    The csv files are written without header. Return tuple of the csv paths,
+    the state of the correction log, the one of the fast validator and the
+    one of the stats (or None) and the type and id of the last element.
+    """
+
+    file_in, start, end, paths, validate, validate_every, parser, stats = job
+
+    fast_validator = None
+    if validate_every is not None:
+        fast_validator = FastValidator(every=validate_every,
+                                       prepare=element_to_dict)
+
+    # a worker processes several shards, the corrections are returned per
+    # shard
+    CC.CORRECTIONS = CorrectionLog(CC.CORRECTIONS.verbose)
+
+    run_stats = None
+    if stats:
+        # the progress is written by the parent process
+        run_stats = RunStats(out=None)
+
+    last = []
+    reader = sharding.ShardReader(file_in, start, end)
+    try:
+        write_elements(track_last_element(
+                           get_element(reader, ELEMENT_TAGS, parser), last),
+                       CsvSink(paths, header=False), validate, fast_validator,
+                       run_stats)
+    finally:
+        reader.close()
+
+    return (paths, CC.CORRECTIONS.get_state(),
+            fast_validator.get_state() if fast_validator is not None else None,
+            run_stats.get_state() if run_stats is not None else None,
+            last)
+
+
+def process_map_parallel(file_in, validate, workers, validate_every=None,
+                         report_path=None, parser=parsers.DEFAULT_PARSER,
+                         stats=False, corrections_path=None, verbose=False,
+                         checkpoints=False, offset=0,
+                         phone_cache_size=CC.PHONE_CACHE_SIZE):
+    """Process the OSM file in shards with a pool of `workers` processes.
+
+    The csv files of the shards are merged in file order, so the result is
+    the same as the one of the serial `process_map`. With `stats=True` the
+    stage times of the workers are summed up, the progress is updated after
+    each shard. With `checkpoints=True` a checkpoint is saved after each
+    merged shard. The file is processed from byte `offset` on, the csv
+    files are appended to then.
+    """
+
+    count = workers * SHARDS_PER_WORKER
+    if checkpoints:
+        count = max(count, (os.path.getsize(file_in) - offset) //
+                    checkpoint.CHECKPOINT_BYTES)
+    shards = sharding.get_shards(file_in, count, offset)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(NODES_PATH) or '.')
+    jobs = [(file_in, start, end,
+             [os.path.join(tmp_dir, '{0}.{1}'.format(i, os.path.basename(p)))
+              for p in CSV_PATHS],
+             validate, validate_every, parser, stats)
+            for i, (start, end) in enumerate(shards)]
+    fast_validator = None
+    if validate_every is not None:
+        fast_validator = FastValidator(every=validate_every,
+                                       prepare=element_to_dict)
+    run_stats = None
+    if stats:
+        run_stats = RunStats(os.path.getsize(file_in))
+    corrections = CorrectionLog()
+
+    pool = multiprocessing.Pool(workers, initializer=CC.init_values,
+                                initargs=(verbose, phone_cache_size))
+    out_files = [codecs.open(p, 'a' if offset else 'w') for p in CSV_PATHS]
+    try:
+        if not offset:
+            for out_file, fields in zip(out_files, CSV_FIELDS):
+                csv.writer(out_file).writerow(fields)
+
+        # `imap` returns the shards in order, while later ones are processed
+        results = pool.imap(process_shard, jobs)
+        for (paths, corrections_state, validator_state, stats_state,
+             last), (_, end) in izip(results, shards):
+            start = time.time()
+            for out_file, path in zip(out_files, paths):
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out_file)
+                os.remove(path)
+            corrections.merge_state(corrections_state)
+            if validator_state is not None:
+                fast_validator.merge_state(validator_state)
+            if stats_state is not None:
+                run_stats.merge_state(stats_state)
+                run_stats.times['write'] += time.time() - start
+                run_stats.bytes_done = end
+                run_stats.progress()
+            if checkpoints:
+                checkpoint.save(CHECKPOINT_PATH, file_in, end, last,
+                                checkpoint.sync_files(out_files))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        for out_file in out_files:
+            out_file.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if checkpoints:
+        checkpoint.remove(CHECKPOINT_PATH)
+    if run_stats is not None:
+        run_stats.write_report(sys.stderr)
+    write_correction_report(corrections, corrections_path)
+    if fast_validator is not None:
+        write_validation_report(fast_validator, report_path)
+
+
+if __name__ == '__main__':
+    #  Note: Validation with cerberus is ~ 10X slower. For the project
+    #  consider using a small sample of the map when validating, or the fast
+    #  validator (`--validate-every N`).
+
+    parser = argparse.ArgumentParser(
+        description='Clean OSM data and save it to CSV files.')
+    parser.add_argument('filename', help='OSM file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--db', dest='db_path',
+                        help='load into this SQLite database instead of csv')
+    parser.add_argument('--parquet', dest='parquet_dir', metavar='DIR',
+                        help='write Parquet files to this directory instead '
+                             'of csv (needs pyarrow)')
+    parser.add_argument('--validate-every', type=int, metavar='N',
+                        dest='validate_every',
+                        help='check every Nth element against the schema')
+    parser.add_argument('--validation-report', dest='report_path',
+                        help='write the schema violations to this file '
+                             '(default: stderr)')
+    parser.add_argument('--geometry', action='store_true',
+                        help='compute the way geometries afterwards '
+                             '(see geometry.py)')
+    parser.add_argument('--parser', choices=sorted(parsers.PARSERS),
+                        help='parser backend (default: pbf for .pbf files, '
+                             'otherwise {0})'.format(parsers.DEFAULT_PARSER))
+    parser.add_argument('--corrections', dest='corrections_path',
+                        metavar='FILE',
+                        help='write the corrections with their counts to '
+                             'this CSV file (JSON for .json)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print each correction')
+    parser.add_argument('--phone-cache-size', type=int, metavar='N',
+                        default=CC.PHONE_CACHE_SIZE,
+                        help='number of phone numbers kept in the cache of '
+                             'the normalizer (default: {0})'.format(
+                                 CC.PHONE_CACHE_SIZE))
+    parser.add_argument('--checkpoints', action='store_true',
+                        help='save checkpoints regularly, to resume the run '
+                             'with --resume if it fails')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue a failed run at its last checkpoint')
+    parser.add_argument('--stats', action='store_true',
+                        help='show the progress and the time of each stage '
+                             'on stderr')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write cProfile statistics to this file (see '
+                             'pstats)')
+    args = parser.parse_args()
+
+    if args.validate_every is not None and args.validate_every < 1:
+        parser.error('--validate-every must be at least 1')
+    if args.phone_cache_size < 0:
+        parser.error('--phone-cache-size must not be negative')
+    if args.db_path is not None and args.parquet_dir is not None:
+        parser.error('--db and --parquet can not be used together')
+    if args.geometry and args.parquet_dir is not None:
+        parser.error('--geometry can not be used with --parquet')
+    if (args.db_path is not None or args.parquet_dir is not None) and \
+            args.workers > 1 and \
+            can_shard(args.filename,
+                      parsers.detect_parser(args.filename, args.parser)):
+        parser.error('--db and --parquet can only be used with a single '
+                     'worker')
+    if (args.checkpoints or args.resume) and \
+            (args.db_path is not None or args.parquet_dir is not None or
+             not can_shard(args.filename,
+                           parsers.detect_parser(args.filename, args.parser))):
+        parser.error('--checkpoints and --resume need csv output and an '
+                     'uncompressed XML file')
+
+    profile = None
+    if args.profile is not None:
+        # only the main process is profiled
+        profile = cProfile.Profile()
+        profile.enable()
+
+    process_map(args.filename, validate=False, workers=args.workers,
+                db_path=args.db_path, validate_every=args.validate_every,
+                report_path=args.report_path, parser=args.parser,
+                parquet_dir=args.parquet_dir, stats=args.stats,
+                corrections_path=args.corrections_path, verbose=args.verbose,
+                checkpoints=args.checkpoints, resume=args.resume,
+                phone_cache_size=args.phone_cache_size)
+
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(args.profile)
+
+    if args.geometry:
+        if args.db_path is not None:
+            geometry.process_geometry_db(args.db_path)
+        else:
+            geometry.process_geometry_csv()
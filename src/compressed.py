@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Read compressed OSM files (.bz2, .gz, .xz) without unpacking them to disk.
+
+`open_input` returns a file-like object for a compressed file. The file is
+decompressed in a background thread, that passes the data to the reader
+through a bounded queue. The decompressors release the GIL, so decompression
+and parsing run on two cores at the same time. Files with several streams
+(e.g. from pbzip2) are supported.
+
+xz files need the `lzma` module (Python 3) or `backports.lzma`.
+"""
+
+import bz2
+import sys
+import zlib
+import Queue
+import threading
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Bytes of compressed data that are read at once
+CHUNK_SIZE = 1024 * 1024
+
+# Number of decompressed chunks buffered between the thread and the reader
+BUFFER_CHUNKS = 16
+
+
+def gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def xz_decompressor():
+    if lzma is None:
+        raise ImportError('Reading .xz files needs the lzma module')
+    return lzma.LZMADecompressor()
+
+
+DECOMPRESSORS = {
+    '.bz2': bz2.BZ2Decompressor,
+    '.gz': gzip_decompressor,
+    '.xz': xz_decompressor,
+}
+
+
+def get_suffix(filename):
+    """Return compression suffix of `filename` or None."""
+
+    if not isinstance(filename, basestring):
+        return None
+    for suffix in DECOMPRESSORS:
+        if filename.endswith(suffix):
+            return suffix
+    return None
+
+
+def is_compressed(filename):
+    """Return True if `filename` is a file name of a compressed file."""
+
+    return get_suffix(filename) is not None
+
+
+def strip_suffix(filename):
+    """Return `filename` without compression suffix."""
+
+    suffix = get_suffix(filename)
+    if suffix is None:
+        return filename
+    return filename[:-len(suffix)]
+
+
+class ThreadedDecompressor(object):
+    """File-like object with the decompressed data of `filename`.
+
+    A background thread reads and decompresses the file with decompressors
+    from `factory` and puts the data into a queue of `buffer_chunks`
+    chunks. `read` takes the data from the queue. `bytes_read` is the
+    number of compressed bytes read from the file so far.
+    """
+
+    def __init__(self, filename, factory, chunk_size=CHUNK_SIZE,
+                 buffer_chunks=BUFFER_CHUNKS):
+        self.factory = factory
+        self.queue = Queue.Queue(maxsize=buffer_chunks)
+        self.stopped = threading.Event()
+        self.error = None
+        self.chunk = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+        # raises the ImportError of a missing decompressor here
+        decompressor = factory()
+        self.thread = threading.Thread(
+            target=self.run, args=(filename, decompressor, chunk_size))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def decompress(self, decompressor, raw):
+        """Return tuple of current decompressor and decompressed `raw`.
+        A new decompressor is started for each new stream."""
+
+        data = []
+        while raw:
+            try:
+                data.append(decompressor.decompress(raw))
+            except EOFError:
+                # the previous stream ended exactly at the chunk border
+                decompressor = self.factory()
+                continue
+            raw = decompressor.unused_data
+            if raw:
+                decompressor = self.factory()
+        return decompressor, ''.join(data)
+
+    def put(self, item):
+        """Put `item` into the queue, unless the reader is closed."""
+
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def run(self, filename, decompressor, chunk_size):
+        """Decompress the file in the background thread."""
+
+        try:
+            with open(filename, 'rb') as f:
+                while not self.stopped.is_set():
+                    raw = f.read(chunk_size)
+                    if not raw:
+                        break
+                    self.bytes_read += len(raw)
+                    decompressor, data = self.decompress(decompressor, raw)
+                    if data:
+                        self.put(data)
+        except Exception:
+            self.error = sys.exc_info()
+        finally:
+            self.put(None)
+
+    def read(self, size=-1):
+        """Read up to `size` bytes (everything, if `size` is negative)."""
+
+        parts = []
+        needed = size
+        while needed != 0:
+            if self.pos >= len(self.chunk):
+                if self.eof:
+                    break
+                chunk = self.queue.get()
+                if chunk is None:
+                    self.eof = True
+                    if self.error is not None:
+                        raise self.error[0], self.error[1], self.error[2]
+                    break
+                self.chunk = chunk
+                self.pos = 0
+                continue
+
+            if needed < 0:
+                part = self.chunk[self.pos:]
+            else:
+                part = self.chunk[self.pos:self.pos + needed]
+                needed -= len(part)
+            self.pos += len(part)
+            parts.append(part)
+        return ''.join(parts)
+
+    def close(self):
+        """Stop the background thread."""
+
+        self.stopped.set()
+        self.thread.join()
+
+
+def open_input(filename):
+    """Return file-like object for reading `filename`. Compressed files
+    are decompressed in a background thread."""
+
+    suffix = get_suffix(filename)
+    if suffix is None:
+        return open(filename, 'rb')
+    return ThreadedDecompressor(filename, DECOMPRESSORS[suffix])
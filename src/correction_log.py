@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Log of the tag corrections made by `check_correct`.
+
+Instead of printing each change, the corrections are counted per rule,
+original and replacement value, with sample element ids. At the end of a
+run the log is written as CSV or JSON report. With `verbose=True` each
+correction is printed as well, e.g. for debugging the mapping files.
+"""
+
+import csv
+import sys
+import json
+
+from collections import Counter
+
+# Number of element ids kept per correction
+SAMPLE_IDS = 5
+
+REPORT_FIELDS = ['rule', 'original', 'replacement', 'count', 'sample_ids']
+
+
+class CorrectionLog(object):
+    """Counts of the corrections by (rule, original, replacement).
+
+    `element_id` is the id of the element, whose tags are corrected at the
+    moment, it is set by `cleaning.iter_tags`.
+    """
+
+    def __init__(self, verbose=False, out=sys.stdout):
+        self.verbose = verbose
+        self.out = out
+        self.element_id = None
+        self.counts = Counter()
+        self.sample_ids = {}
+
+    def record(self, rule, original, replacement):
+        """Count a correction of `original` to `replacement` (None, if the
+        value was not replaced) by `rule`."""
+
+        key = (rule, original, replacement)
+        self.counts[key] += 1
+        sample_ids = self.sample_ids.get(key)
+        if sample_ids is None:
+            self.sample_ids[key] = [self.element_id]
+        elif len(sample_ids) < SAMPLE_IDS:
+            sample_ids.append(self.element_id)
+
+        if self.verbose:
+            self.out.write('Change {0}: {1} => {2}\n'.format(
+                rule, original, replacement if replacement is not None
+                else '-'))
+
+    def get_state(self):
+        """Return the collected counts as picklable tuple."""
+
+        return self.counts, self.sample_ids
+
+    def merge_state(self, state):
+        """Add the counts of another log (see `get_state`)."""
+
+        counts, sample_ids = state
+        self.counts.update(counts)
+        for key, ids in sample_ids.iteritems():
+            own_ids = self.sample_ids.setdefault(key, [])
+            own_ids.extend(ids[:SAMPLE_IDS - len(own_ids)])
+
+    def rows(self):
+        """Yield report rows (see `REPORT_FIELDS`), most frequent first."""
+
+        for (rule, original, replacement), count in sorted(
+                self.counts.iteritems(), key=lambda item: (-item[1], item[0])):
+            yield [rule, original, replacement or '', count,
+                   self.sample_ids[(rule, original, replacement)]]
+
+    def write_summary(self, f):
+        """Write the number of corrections per rule to file `f`."""
+
+        rules = Counter()
+        for (rule, _, _), count in self.counts.iteritems():
+            rules[rule] += count
+        f.write('Corrections: {0}\n'.format(', '.join(
+            '{0} {1}'.format(rule, count)
+            for rule, count in sorted(rules.iteritems())) or 'none'))
+
+    def write_report(self, path):
+        """Write all corrections to `path`, as JSON if it ends with
+        `.json`, otherwise as CSV."""
+
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump([dict(zip(REPORT_FIELDS, row))
+                           for row in self.rows()], f, indent=1)
+                f.write('\n')
+        else:
+            with open(path, 'wb') as f:
+                writer = csv.writer(f)
+                writer.writerow(REPORT_FIELDS)
+                for row in self.rows():
+                    row[-1] = ' '.join(str(i) for i in row[-1])
+                    writer.writerow(row)
@@ -0,0 +1,25 @@
+CREATE INDEX nodes_tags_id ON nodes_tags (id);
+CREATE INDEX nodes_tags_key ON nodes_tags (key);
+
+CREATE INDEX ways_tags_id ON ways_tags (id);
+CREATE INDEX ways_tags_key ON ways_tags (key);
+
+CREATE INDEX ways_nodes_id ON ways_nodes (id);
+CREATE INDEX ways_nodes_node_id ON ways_nodes (node_id);
+
+CREATE INDEX relations_tags_id ON relations_tags (id);
+CREATE INDEX relations_tags_key ON relations_tags (key);
+
+CREATE INDEX relations_members_id ON relations_members (id);
+CREATE INDEX relations_members_member_id ON relations_members (member_id);
+
+CREATE VIRTUAL TABLE nodes_rtree USING rtree (
+    id, min_lat, max_lat, min_lon, max_lon
+);
+INSERT INTO nodes_rtree
+    SELECT id, lat, lat, lon, lon FROM nodes
+    WHERE lat IS NOT NULL AND lon IS NOT NULL;
+
+CREATE VIRTUAL TABLE ways_rtree USING rtree (
+    id, min_lat, max_lat, min_lon, max_lon
+);
@@ -4,15 +4,27 @@
 Takes an OSM file name as first argument and either 'way' or 'node' as second.
 After looping through the data, the most common tag keys and their values are
 printed. These can be explored further by entering the tag key of interest.
+
+The file is parsed as a stream and only the counts of the tag values are
+kept in memory. With `--top-k K` only about the K most common values per tag
+key are counted (see `top_values.py`), which bounds the memory for keys with
+many unique values. Their counts may then be too high by the shown error.
+
+The counts are saved in an index file next to the OSM file (see
+`tag_index.py`), so later sessions start without parsing the file again.
 """
 
 import sys
+import argparse
 import xml.etree.cElementTree as ET
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 
 
 from util import to_str
+import parsers
+import tag_index
+from top_values import TopValues
 
 def is_tag_type(elem, tag_type):
     """Return true if element is of type `tag_type`."""
@@ -46,6 +58,71 @@ def audit(filename, tag_type='way'):
 
     return tag_types
 
+def iter_elements(filename, tag_type):
+    """Yield elements of type `tag_type` (from OSM XML or PBF) and remove
+    all parsed elements from memory afterwards."""
+
+    return parsers.iter_elements(filename, (tag_type,))
+
+
+def audit_stream(filename, tag_type='way', top_k=None):
+    """Process the file as stream and count tags and their values.
+
+    Return a tuple of a Counter with the count of each tag key and a dict
+    with tag keys as keys, mapping to a Counter of their values.
+
+    If `top_k` is given, the values are counted with `TopValues` of
+    `top_k`, so the counts are upper bounds with an error, and values seen
+    less often than about `count / (2 * top_k)` times may be missing.
+    """
+
+    tag_count = Counter()
+    if top_k is None:
+        tag_values_unique = defaultdict(Counter)
+    else:
+        tag_values_unique = defaultdict(lambda: TopValues(top_k))
+
+    sys.stderr.write("Audit tags of type `" + tag_type + "`\n")
+    for elem in iter_elements(filename, tag_type):
+        for tag in elem.iter('tag'):
+            tag_key = to_str(tag.attrib['k'])
+            tag_count[tag_key] += 1
+
+            tag_value = to_str(tag.attrib['v'])
+            if top_k is None:
+                tag_values_unique[tag_key][tag_value] += 1
+            else:
+                tag_values_unique[tag_key].add(tag_value)
+
+    print_tag_type_counts(tag_count)
+
+    # plain dict, unknown tag keys raise a KeyError
+    return tag_count, dict(tag_values_unique)
+
+def audit_indexed(filename, tag_type='way', top_k=None):
+    """Like `audit_stream`, but read the counts from the index of the file,
+    if it is up to date. Otherwise audit the file and update the index."""
+
+    counts = tag_index.read_index(filename, tag_type, top_k)
+    if counts is not None:
+        sys.stderr.write("Read tags of type `" + tag_type + "` from index\n")
+        print_tag_type_counts(counts[0])
+        return counts
+
+    tag_count, tag_values_unique = audit_stream(filename, tag_type, top_k)
+    tag_index.write_index(filename, tag_type, top_k,
+                          tag_count, tag_values_unique)
+    return tag_count, tag_values_unique
+
+def print_tag_type_counts(tag_count):
+    """Print tag types used more than 5 times with their count."""
+
+    sys.stderr.write("This are all tag types used 5+ times:\n")
+    for tag, count in tag_count.most_common():
+        if count > 5:
+            sys.stderr.write(str(count) + "\t" + tag + "\n")
+    sys.stderr.write("\n---\n")
+
 def get_unique_values_and_count(values):
     """Take a list of values and return a dict with
     unique values and their count in the original list
@@ -61,8 +138,9 @@ def print_tag_values_and_counts(tag_values_unique, tag_key, limit=None):
     and an optional `limit` that defines the maximum number of printed values.
     """
 
-    # get tag values of interest
+    # get tag values of interest, approximate counts have errors
     tag_values = tag_values_unique[tag_key]
+    errors = getattr(tag_values, 'errors', {})
 
     # loop the tag values, sorted by their count and limit if applicable
     for tag_value in sorted(tag_values,
@@ -70,7 +148,11 @@ def print_tag_values_and_counts(tag_values_unique, tag_key, limit=None):
                             reverse=True)[:limit]:
         try:
             # print tag value count, tab char and tag value
-            print tag_values[tag_value], '\t', tag_value
+            if tag_value in errors:
+                print tag_values[tag_value], '\t', tag_value, \
+                    '\t(error <= {0})'.format(errors[tag_value])
+            else:
+                print tag_values[tag_value], '\t', tag_value
         except UnicodeEncodeError:
             continue
 
@@ -117,6 +199,16 @@ def audit_tags(tag_types):
         # unique values for the tag
         tag_values_unique[tag] = get_unique_values_and_count(values)
 
+    audit_tag_counts(tag_count, tag_values_unique)
+
+def audit_tag_counts(tag_count, tag_values_unique):
+    """ Print info about tags and start the interactive shell.
+
+    Takes `tag_count` dict with the count of each tag and
+    `tag_values_unique` dict with the count of each value per tag. If the
+    values of a tag were approximated (`TopValues`), their number is shown
+    as a lower bound."""
+
     # Tags sorted by their count (greatest last)
     # plus count of their unique values
     for tag in sorted(tag_count, key=tag_count.get, reverse=True)[:10]:
@@ -124,7 +216,12 @@ def audit_tags(tag_types):
         print '---'
         print 'Tag Name:\t', tag
         print 'Count:\t\t', tag_count[tag]
-        print 'Unique:\t\t', len(tag_values_unique[tag])
+        values = tag_values_unique[tag]
+        if getattr(values, 'errors', None):
+            # values were replaced (`top_k`), more of them exist
+            print 'Unique:\t\tat least', len(values)
+        else:
+            print 'Unique:\t\t', len(values)
         print '\n-'
 
         print_tag_values_and_counts(tag_values_unique, tag, 20)
@@ -140,7 +237,19 @@ def print_tag_types(tag_types):
 
 if __name__ == "__main__":
     #print_tag_types(audit(sys.argv[1]))
-    if len(sys.argv) is not 3:
-        print 'Error! Please provide filename and tag type as argument!'
+    parser = argparse.ArgumentParser(
+        description='Explore OSM data in an interactive shell.')
+    parser.add_argument('filename', help='OSM file')
+    parser.add_argument('tag_type', choices=('way', 'node'),
+                        help='type of elements to explore')
+    parser.add_argument('--top-k', type=int, dest='top_k',
+                        help='keep only about K most common values per tag')
+    parser.add_argument('--no-index', action='store_true', dest='no_index',
+                        help='neither read nor write the tag index file')
+    args = parser.parse_args()
+
+    if args.no_index:
+        counts = audit_stream(args.filename, args.tag_type, args.top_k)
     else:
-        audit_tags(audit(sys.argv[1], sys.argv[2]))
+        counts = audit_indexed(args.filename, args.tag_type, args.top_k)
+    audit_tag_counts(*counts)
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""Compute way geometries from the cleaned data.
+
+Runs after `cleaning.process_map`. First the coordinates of all nodes are
+written to a memory-mapped index file: fixed-point int32 (lat, lon) pairs
+(1e-7 degrees, like in OSM) in the order of the node ids, which are kept
+in a sorted array and looked up by binary search. So the index only takes
+space for the existing nodes, however large their ids are. Then the
+`ways_nodes` rows are read in one streaming pass, the node refs are
+resolved with the index and the length, area, bounding box and centroid of
+each way are written to `ways_geometry`.
+
+Reads and writes the csv files, or the SQLite database with `--db`.
+"""
+
+import os
+import csv
+import sys
+import math
+import mmap
+import struct
+import sqlite3
+import argparse
+
+from array import array
+from bisect import bisect_left
+from itertools import chain, groupby
+from operator import itemgetter
+
+from records import node_id_array
+
+NODES_PATH = 'csv/nodes.csv'
+WAY_NODES_PATH = 'csv/ways_nodes.csv'
+WAY_GEOMETRY_PATH = 'csv/ways_geometry.csv'
+INDEX_SUFFIX = '.coords'
+
+WAY_GEOMETRY_FIELDS = ['id', 'length', 'area', 'min_lat', 'min_lon',
+                       'max_lat', 'max_lon', 'centroid_lat', 'centroid_lon',
+                       'missing_nodes']
+
+# Fixed-point factor of the coordinates in the index
+FIXED_POINT = 10 ** 7
+COORDS = struct.Struct('<ii')
+
+# Number of coordinate values buffered while writing the index file
+WRITE_BUFFER_SIZE = 64 * 1024
+
+EARTH_RADIUS = 6371008.8
+
+
+#  ================================================== #
+#                Node Coordinate Index                #
+#  ================================================== #
+class NodeIndex(object):
+    """Index of node coordinates, see `build_node_index`.
+
+    The node ids are kept sorted in `ids` (see `records.node_id_array`),
+    the coordinates of the node at position i are the i-th pair in the
+    memory-mapped file at `path`.
+    """
+
+    def __init__(self, path, ids):
+        self.path = path
+        self.ids = ids
+        self.file = open(path, 'rb')
+        # an empty file can not be mapped
+        self.mm = None
+        if ids:
+            self.mm = mmap.mmap(self.file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+
+    def get(self, node_id):
+        """Return tuple of lat and lon of node `node_id` or None."""
+
+        position = bisect_left(self.ids, node_id)
+        if position == len(self.ids) or self.ids[position] != node_id:
+            return None
+        lat, lon = COORDS.unpack_from(self.mm, position * COORDS.size)
+        return float(lat) / FIXED_POINT, float(lon) / FIXED_POINT
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.file.close()
+
+
+def write_coords(f, coords):
+    """Append the int array `coords` to file `f` in little-endian order."""
+
+    if sys.byteorder != 'little':
+        coords.byteswap()
+    coords.tofile(f)
+
+
+def build_node_index(nodes, path):
+    """Create index at `path` from (id, lat, lon) rows and return it.
+
+    The coordinates are written in the order of the rows. OSM files list the
+    nodes sorted by id, other input is sorted afterwards.
+    """
+
+    ids = node_id_array()
+    ordered = True
+    with open(path, 'wb') as f:
+        coords = array('i')
+        for node_id, lat, lon in nodes:
+            if lat in (None, '') or lon in (None, ''):
+                continue
+            node_id = int(node_id)
+            if ids and node_id <= ids[-1]:
+                ordered = False
+            ids.append(node_id)
+            coords.append(int(round(float(lat) * FIXED_POINT)))
+            coords.append(int(round(float(lon) * FIXED_POINT)))
+            if len(coords) >= WRITE_BUFFER_SIZE:
+                write_coords(f, coords)
+                coords = array('i')
+        write_coords(f, coords)
+
+    if not ordered:
+        with open(path, 'rb') as f:
+            coords = array('i')
+            coords.fromfile(f, 2 * len(ids))
+        if sys.byteorder != 'little':
+            coords.byteswap()
+        order = sorted(xrange(len(ids)), key=ids.__getitem__)
+        ids = node_id_array(ids[i] for i in order)
+        coords = array('i', chain.from_iterable(
+            coords[2 * i:2 * i + 2] for i in order))
+        with open(path, 'wb') as f:
+            write_coords(f, coords)
+    return NodeIndex(path, ids)
+
+
+#  ================================================== #
+#                Geometry                             #
+#  ================================================== #
+def distance(lat1, lon1, lat2, lon2):
+    """Return great-circle distance of two points in meters."""
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) *
+         math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def way_geometry(coords):
+    """Return dict of the geometry of a way with the list of (lat, lon)
+    `coords`, see `WAY_GEOMETRY_FIELDS`.
+
+    The area and the centroid of closed ways are computed in a local
+    equirectangular projection, the centroid of other ways is the length
+    weighted center of their segments.
+    """
+
+    lats = [lat for lat, _ in coords]
+    lons = [lon for _, lon in coords]
+    geometry = {'min_lat': min(lats), 'min_lon': min(lons),
+                'max_lat': max(lats), 'max_lon': max(lons),
+                'length': 0.0, 'area': 0.0}
+
+    center_lat = center_lon = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(coords, coords[1:]):
+        segment = distance(lat1, lon1, lat2, lon2)
+        geometry['length'] += segment
+        center_lat += segment * (lat1 + lat2) / 2
+        center_lon += segment * (lon1 + lon2) / 2
+    if geometry['length'] > 0:
+        center_lat /= geometry['length']
+        center_lon /= geometry['length']
+    else:
+        center_lat = sum(lats) / len(lats)
+        center_lon = sum(lons) / len(lons)
+
+    if len(coords) > 3 and coords[0] == coords[-1]:
+        # shoelace formula in meters relative to the first node
+        lat0, lon0 = coords[0]
+        scale_y = math.radians(1) * EARTH_RADIUS
+        scale_x = scale_y * math.cos(math.radians(lat0))
+        points = [((lon - lon0) * scale_x, (lat - lat0) * scale_y)
+                  for lat, lon in coords]
+        area = cx = cy = 0.0
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            cross = x1 * y2 - x2 * y1
+            area += cross
+            cx += (x1 + x2) * cross
+            cy += (y1 + y2) * cross
+        if area:
+            center_lon = lon0 + cx / (3 * area) / scale_x
+            center_lat = lat0 + cy / (3 * area) / scale_y
+        geometry['area'] = abs(area) / 2
+
+    geometry['centroid_lat'] = center_lat
+    geometry['centroid_lon'] = center_lon
+    return geometry
+
+
+def iter_geometries(way_nodes, index):
+    """Yield geometry dict of each way of the (id, node_id) rows in
+    `way_nodes`, which are grouped by way id in node order."""
+
+    for way_id, rows in groupby(way_nodes, key=itemgetter(0)):
+        coords = []
+        missing = 0
+        for _, node_id in rows:
+            point = index.get(int(node_id))
+            if point is None:
+                missing += 1
+            else:
+                coords.append(point)
+        if not coords:
+            continue
+
+        geometry = way_geometry(coords)
+        geometry['id'] = way_id
+        geometry['missing_nodes'] = missing
+        yield geometry
+
+
+def format_row(geometry):
+    """Return list of the csv values of `geometry`."""
+
+    row = []
+    for field in WAY_GEOMETRY_FIELDS:
+        value = geometry[field]
+        if field in ('length', 'area'):
+            value = '{0:.2f}'.format(value)
+        elif isinstance(value, float):
+            value = '{0:.7f}'.format(value)
+        row.append(value)
+    return row
+
+
+#  ================================================== #
+#                Main Functions                       #
+#  ================================================== #
+def read_csv_columns(path, columns):
+    """Yield tuples of the `columns` of each row of csv file `path`."""
+
+    with open(path, 'rb') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        positions = [header.index(column) for column in columns]
+        for row in reader:
+            yield tuple(row[i] for i in positions)
+
+
+def process_geometry_csv(nodes_path=NODES_PATH, way_nodes_path=WAY_NODES_PATH,
+                         out_path=WAY_GEOMETRY_PATH, index_path=None):
+    """Write the geometries of the ways in the csv files to `out_path`."""
+
+    index_path = index_path or nodes_path + INDEX_SUFFIX
+    index = build_node_index(
+        read_csv_columns(nodes_path, ('id', 'lat', 'lon')), index_path)
+    try:
+        with open(out_path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(WAY_GEOMETRY_FIELDS)
+            for geometry in iter_geometries(
+                    read_csv_columns(way_nodes_path, ('id', 'node_id')),
+                    index):
+                writer.writerow(format_row(geometry))
+    finally:
+        index.close()
+
+
+def process_geometry_db(db_path, index_path=None):
+    """Fill the `ways_geometry` and `ways_rtree` tables of the SQLite
+    database at `db_path`."""
+
+    index_path = index_path or db_path + INDEX_SUFFIX
+    conn = sqlite3.connect(db_path)
+    index = build_node_index(conn.execute('SELECT id, lat, lon FROM nodes'),
+                             index_path)
+    # the ways_nodes are read with a second cursor while inserting
+    try:
+        way_nodes = conn.execute(
+            'SELECT id, node_id FROM ways_nodes ORDER BY id, position')
+        rows = (format_row(geometry)
+                for geometry in iter_geometries(way_nodes, index))
+        conn.execute('DELETE FROM ways_geometry')
+        conn.executemany(
+            'INSERT INTO ways_geometry ({0}) VALUES ({1})'.format(
+                ', '.join(WAY_GEOMETRY_FIELDS),
+                ', '.join('?' * len(WAY_GEOMETRY_FIELDS))),
+            rows)
+        # bounding boxes of the ways for the spatial queries (spatial.py)
+        conn.execute('DELETE FROM ways_rtree')
+        conn.execute('INSERT INTO ways_rtree SELECT id, min_lat, max_lat, '
+                     'min_lon, max_lon FROM ways_geometry')
+        conn.commit()
+    finally:
+        index.close()
+        conn.close()
+
+
+def update_geometry_db(db_path, way_ids, node_ids=()):
+    """Recompute the `ways_geometry` and `ways_rtree` rows of the ways with
+    `way_ids` and of the ways that use one of the nodes with `node_ids`,
+    e.g. after an OsmChange file is applied. Deleted ways lose their rows.
+    Nothing is done, if the geometries were never computed."""
+
+    conn = sqlite3.connect(db_path)
+    try:
+        if conn.execute('SELECT 1 FROM ways_geometry LIMIT 1').fetchone() \
+                is None:
+            return
+        ids = set(int(way_id) for way_id in way_ids)
+        for node_id in node_ids:
+            ids.update(row[0] for row in conn.execute(
+                'SELECT DISTINCT id FROM ways_nodes WHERE node_id = ?',
+                (int(node_id),)))
+        rows = [(way_id,) for way_id in sorted(ids)]
+        conn.executemany('DELETE FROM ways_geometry WHERE id = ?', rows)
+        conn.executemany('DELETE FROM ways_rtree WHERE id = ?', rows)
+
+        # the coordinates of the few nodes involved are looked up in a dict
+        way_nodes = []
+        coords = {}
+        for way_id, in rows:
+            for node_id, lat, lon in conn.execute(
+                    'SELECT w.node_id, n.lat, n.lon FROM ways_nodes w '
+                    'LEFT JOIN nodes n ON n.id = w.node_id '
+                    'WHERE w.id = ? ORDER BY w.position', (way_id,)):
+                way_nodes.append((way_id, node_id))
+                if lat is not None and lon is not None:
+                    coords[int(node_id)] = (float(lat), float(lon))
+
+        conn.executemany(
+            'INSERT INTO ways_geometry ({0}) VALUES ({1})'.format(
+                ', '.join(WAY_GEOMETRY_FIELDS),
+                ', '.join('?' * len(WAY_GEOMETRY_FIELDS))),
+            [format_row(geometry)
+             for geometry in iter_geometries(way_nodes, coords)])
+        conn.executemany(
+            'INSERT INTO ways_rtree SELECT id, min_lat, max_lat, min_lon, '
+            'max_lon FROM ways_geometry WHERE id = ?', rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def update_geometry_csv(way_ids, node_ids=(), nodes_path=NODES_PATH,
+                        way_nodes_path=WAY_NODES_PATH,
+                        out_path=WAY_GEOMETRY_PATH, index_path=None):
+    """Like `update_geometry_db` for the csv files: the rows of the ways
+    with `way_ids` and of the ways that use one of the nodes with
+    `node_ids` are removed from `out_path`, the ones of the remaining ways
+    are recomputed and appended. The node index does not fit the nodes
+    anymore, so it is removed. Nothing is done, if the geometries were
+    never computed."""
+
+    index_path = index_path or nodes_path + INDEX_SUFFIX
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    if not os.path.exists(out_path):
+        return
+
+    way_ids = set(str(way_id) for way_id in way_ids)
+    node_ids = set(str(node_id) for node_id in node_ids)
+    way_nodes = []
+    for way_id, rows in groupby(
+            read_csv_columns(way_nodes_path, ('id', 'node_id')),
+            key=itemgetter(0)):
+        rows = list(rows)
+        if way_id in way_ids or any(node_id in node_ids
+                                    for _, node_id in rows):
+            way_ids.add(way_id)
+            way_nodes.extend(rows)
+
+    # the coordinates of the few nodes involved are looked up in a dict
+    needed = set(int(node_id) for _, node_id in way_nodes)
+    coords = {}
+    for node_id, lat, lon in read_csv_columns(nodes_path,
+                                              ('id', 'lat', 'lon')):
+        if int(node_id) in needed and lat and lon:
+            coords[int(node_id)] = (float(lat), float(lon))
+
+    tmp_path = out_path + '.tmp'
+    with open(out_path, 'rb') as f_in, open(tmp_path, 'wb') as f_out:
+        reader = csv.reader(f_in)
+        writer = csv.writer(f_out)
+        writer.writerow(next(reader))
+        for row in reader:
+            if row[0] not in way_ids:
+                writer.writerow(row)
+        for geometry in iter_geometries(way_nodes, coords):
+            writer.writerow(format_row(geometry))
+    os.rename(tmp_path, out_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compute way geometries of the cleaned data.')
+    parser.add_argument('--db', dest='db_path',
+                        help='read and write this SQLite database instead '
+                             'of csv')
+    parser.add_argument('--index', dest='index_path',
+                        help='path of the node coordinate index file '
+                             '(default: next to the nodes)')
+    args = parser.parse_args()
+
+    if args.db_path is not None:
+        process_geometry_db(args.db_path, args.index_path)
+    else:
+        process_geometry_csv(index_path=args.index_path)
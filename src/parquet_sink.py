@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Write shaped OSM elements to typed, compressed Parquet files.
+
+Each table of `data_wrangling_schema.sql` goes into its own file
+(`nodes.parquet`, `nodes_tags.parquet`, ...) with the column types of the
+sql schema. Rows are collected column by column and written as a row group
+once `row_group_size` rows are buffered, so the memory use is bounded by the
+row group size. The repetitive `user`, `key`, `type`, `member_type` and
+`role` columns are dictionary encoded.
+
+Needs the pyarrow package, which is optional for the other scripts.
+"""
+
+import os
+import sys
+import time
+from itertools import repeat
+
+from util import to_unicode
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARQUET_DIR = 'parquet'
+
+# Number of rows per table in one row group
+ROW_GROUP_SIZE = 100000
+
+COMPRESSION = 'snappy'
+DICTIONARY_COLUMNS = ('user', 'key', 'type', 'member_type', 'role')
+
+# Table name and columns with their arrow type, in the order of the sql schema
+NODES = ('nodes', (('id', 'int64'), ('lat', 'float64'), ('lon', 'float64'),
+                   ('user', 'string'), ('uid', 'int64'),
+                   ('version', 'int64'), ('changeset', 'int64'),
+                   ('timestamp', 'string')))
+NODES_TAGS = ('nodes_tags', (('id', 'int64'), ('key', 'string'),
+                             ('value', 'string'), ('type', 'string')))
+WAYS = ('ways', (('id', 'int64'), ('user', 'string'), ('uid', 'int64'),
+                 ('version', 'string'), ('changeset', 'int64'),
+                 ('timestamp', 'string')))
+WAYS_NODES = ('ways_nodes', (('id', 'int64'), ('node_id', 'int64'),
+                             ('position', 'int64')))
+WAYS_TAGS = ('ways_tags', (('id', 'int64'), ('key', 'string'),
+                           ('value', 'string'), ('type', 'string')))
+RELATIONS = ('relations', (('id', 'int64'), ('user', 'string'),
+                           ('uid', 'int64'), ('version', 'string'),
+                           ('changeset', 'int64'), ('timestamp', 'string')))
+RELATIONS_MEMBERS = ('relations_members', (('id', 'int64'),
+                                           ('member_id', 'int64'),
+                                           ('member_type', 'string'),
+                                           ('role', 'string'),
+                                           ('position', 'int64')))
+RELATIONS_TAGS = ('relations_tags', (('id', 'int64'), ('key', 'string'),
+                                     ('value', 'string'), ('type', 'string')))
+
+TABLES = (NODES, NODES_TAGS, WAYS, WAYS_NODES, WAYS_TAGS, RELATIONS,
+          RELATIONS_MEMBERS, RELATIONS_TAGS)
+
+# Functions that convert the shaped string values to the column types
+CONVERTERS = {
+    'int64': int,
+    'float64': float,
+    'string': to_unicode,
+}
+
+
+class TableWriter(object):
+    """Buffer the rows of one table by column and write them as row groups
+    to the Parquet file at `path`."""
+
+    def __init__(self, path, table, row_group_size=ROW_GROUP_SIZE,
+                 compression=COMPRESSION):
+        _, columns = table
+        self.names = [name for name, _ in columns]
+        self.types = [getattr(pa, type_name)() for _, type_name in columns]
+        self.converters = [CONVERTERS[type_name] for _, type_name in columns]
+        self.schema = pa.schema([pa.field(name, arrow_type)
+                                 for name, arrow_type
+                                 in zip(self.names, self.types)])
+        self.writer = pq.ParquetWriter(
+            path, self.schema, compression=compression,
+            use_dictionary=[name for name in self.names
+                            if name in DICTIONARY_COLUMNS])
+        self.row_group_size = row_group_size
+        self.columns = [[] for _ in self.names]
+        self.row_count = 0
+        self.row_groups = 0
+
+    def add_rows(self, rows):
+        """Add `rows` (tuples in column order) to the buffer, write a row
+        group if full."""
+
+        for row in rows:
+            for convert, values, value in zip(self.converters, self.columns,
+                                              row):
+                values.append(None if value is None else convert(value))
+        if len(self.columns[0]) >= self.row_group_size:
+            self.flush()
+
+    def add_columns(self, columns):
+        """Add rows given as one iterable per column, with values that
+        already have the column type."""
+
+        for values, column in zip(self.columns, columns):
+            values.extend(column)
+        if len(self.columns[0]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as one row group."""
+
+        size = len(self.columns[0])
+        if not size:
+            return
+        arrays = [pa.array(values, type=arrow_type)
+                  for values, arrow_type in zip(self.columns, self.types)]
+        self.writer.write_table(pa.Table.from_arrays(arrays,
+                                                     schema=self.schema))
+        self.columns = [[] for _ in self.names]
+        self.row_count += size
+        self.row_groups += 1
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ParquetSink(object):
+    """Write shaped elements to one Parquet file per table in `out_dir`."""
+
+    def __init__(self, out_dir=PARQUET_DIR, row_group_size=ROW_GROUP_SIZE,
+                 compression=COMPRESSION):
+        if pa is None:
+            raise ImportError('The Parquet output needs the pyarrow package')
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+        self.tables = {}
+        for table in TABLES:
+            path = os.path.join(out_dir, table[0] + '.parquet')
+            self.tables[table] = TableWriter(path, table, row_group_size,
+                                             compression)
+        self.start_time = time.time()
+
+    def write_node(self, el):
+        self.tables[NODES].add_rows([el['node']])
+        self.tables[NODES_TAGS].add_rows(el['node_tags'])
+
+    def write_way(self, el):
+        self.tables[WAYS].add_rows([el['way']])
+        way = el['way_nodes']
+        self.tables[WAYS_NODES].add_columns(
+            [repeat(int(way.id), len(way)), way.node_ids, xrange(len(way))])
+        self.tables[WAYS_TAGS].add_rows(el['way_tags'])
+
+    def write_relation(self, el):
+        self.tables[RELATIONS].add_rows([el['relation']])
+        self.tables[RELATIONS_MEMBERS].add_rows(el['relation_members'])
+        self.tables[RELATIONS_TAGS].add_rows(el['relation_tags'])
+
+    def close(self):
+        """Write the remaining rows, close the files and report the
+        throughput."""
+
+        for writer in self.tables.itervalues():
+            writer.close()
+        total_time = time.time() - self.start_time
+        row_count = sum(w.row_count for w in self.tables.itervalues())
+        row_groups = sum(w.row_groups for w in self.tables.itervalues())
+
+        sys.stderr.write(
+            'Wrote {0} rows in {1} row groups in {2:.1f}s '
+            '({3:.0f} rows/s)\n'.format(row_count, row_groups, total_time,
+                                        row_count / max(total_time, 1e-6)))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Parser backends that yield the top level elements of an OSM file.
+
+- `etree`: `cElementTree.iterparse`, the original backend
+- `lxml`: `lxml.etree.iterparse` with tag filtering, processed elements and
+  their preceding siblings are removed from the tree (needs lxml)
+- `expat`: raw expat parser, that builds lightweight `Record` objects
+  instead of a tree
+- `pbf`: reader for OSM PBF files (see `pbf.py`)
+
+All backends take a file name or file-like object and yield objects with
+`tag`, `attrib` and `iter(tag)`, as used by `cleaning.shape_element`.
+An element is only valid until the next one is yielded.
+
+`iter_elements` selects the `pbf` backend for files ending with `.pbf` and
+reads `.bz2`, `.gz` and `.xz` compressed files (see `compressed.py`).
+"""
+
+import xml.etree.cElementTree as ET
+from xml.parsers import expat
+
+import pbf
+import compressed
+from records import Record, ChildRecord
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+DEFAULT_PARSER = 'etree'
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+CHILD_TAGS = ('tag', 'nd', 'member')
+
+# Number of bytes passed to expat at once
+EXPAT_CHUNK_SIZE = 64 * 1024
+
+
+def get_element_etree(osm_file, tags=TOP_LEVEL_TAGS):
+    """Yield element if it is the right type of tag"""
+
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in TOP_LEVEL_TAGS:
+            if elem.tag in tags:
+                yield elem
+            root.clear()
+
+
+def get_element_lxml(osm_file, tags=TOP_LEVEL_TAGS):
+    """Yield element if it is the right type of tag, parsed by lxml"""
+
+    if lxml_etree is None:
+        raise ImportError('The lxml parser needs the lxml package')
+
+    context = lxml_etree.iterparse(osm_file, events=('end',),
+                                   tag=TOP_LEVEL_TAGS)
+    for _, elem in context:
+        if elem.tag in tags:
+            yield elem
+        # free the element and the already processed siblings
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+class ExpatHandler(object):
+    """Collect `Record`s of the types in `tags` from expat events."""
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.current = None
+        self.records = []
+
+    def start(self, name, attrib):
+        if name in TOP_LEVEL_TAGS:
+            self.current = Record(name, attrib)
+        elif self.current is not None and name in CHILD_TAGS:
+            self.current.children.append(ChildRecord(name, attrib))
+
+    def end(self, name):
+        if name in TOP_LEVEL_TAGS:
+            if name in self.tags:
+                self.records.append(self.current)
+            self.current = None
+
+
+def get_element_expat(osm_file, tags=TOP_LEVEL_TAGS):
+    """Yield `Record` if it is the right type of tag, parsed by expat"""
+
+    handler = ExpatHandler(tags)
+    parser = expat.ParserCreate()
+    # keep the utf-8 encoded strings, like the other backends do for ascii
+    parser.returns_unicode = False
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+
+    close_file = not hasattr(osm_file, 'read')
+    if close_file:
+        osm_file = open(osm_file, 'rb')
+    try:
+        while True:
+            data = osm_file.read(EXPAT_CHUNK_SIZE)
+            parser.Parse(data, not data)
+            for record in handler.records:
+                yield record
+            handler.records = []
+            if not data:
+                break
+    finally:
+        if close_file:
+            osm_file.close()
+
+
+PARSERS = {
+    'etree': get_element_etree,
+    'lxml': get_element_lxml,
+    'expat': get_element_expat,
+    'pbf': pbf.get_element_pbf,
+}
+
+
+def detect_parser(osm_file, parser=None):
+    """Return `parser` or, if it is None, the backend for the file type."""
+
+    if parser is not None:
+        return parser
+    if (isinstance(osm_file, basestring) and
+            compressed.strip_suffix(osm_file).endswith('.pbf')):
+        return 'pbf'
+    return DEFAULT_PARSER
+
+
+def iter_elements(osm_file, tags=TOP_LEVEL_TAGS, parser=None, workers=1):
+    """Yield the elements of type `tags` with the `parser` backend (or the
+    one for the file type). `workers` processes decode PBF files.
+    Compressed files are decompressed in a background thread."""
+
+    parser = detect_parser(osm_file, parser)
+    source = osm_file
+    if compressed.is_compressed(osm_file):
+        source = compressed.open_input(osm_file)
+    try:
+        if parser == 'pbf':
+            elements = pbf.get_element_pbf(source, tags, workers)
+        else:
+            elements = PARSERS[parser](source, tags)
+        for element in elements:
+            yield element
+    finally:
+        if source is not osm_file:
+            source.close()
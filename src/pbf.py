@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""Read OSM PBF files (.osm.pbf) without converting them to XML.
+
+The file consists of blobs with zlib compressed protocol buffer messages.
+The messages are decoded with a small wire format reader, so no protobuf
+package is needed. The elements are yielded as `records.Record` objects with
+the same attributes as in OSM XML, so `cleaning.shape_element` can process
+them like the elements of the XML parsers. Dense nodes are supported.
+
+With more than one worker, the blobs are decompressed and decoded in a pool
+of processes, while the elements are yielded in file order.
+
+See https://wiki.openstreetmap.org/wiki/PBF_Format for the format.
+"""
+
+import zlib
+import struct
+import multiprocessing
+
+from datetime import datetime
+from collections import deque
+
+from records import Record, ChildRecord
+
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+# Number of blobs per worker that are decoded ahead
+BLOBS_PER_WORKER = 4
+
+
+# --- Wire format ---
+# ////////////////////////////////////////////////////////////////////
+
+def read_varint(buf, pos):
+    """Return tuple of varint at `pos` in `buf` and position after it."""
+
+    result = 0
+    shift = 0
+    while True:
+        b = ord(buf[pos])
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value):
+    """Decode zigzag encoded (sint) value."""
+
+    return (value >> 1) ^ -(value & 1)
+
+
+def to_signed(value):
+    """Interpret varint `value` as signed 64 bit integer (int32/int64)."""
+
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def iter_fields(buf):
+    """Yield tuples of field number, wire type and value of a message.
+    The value is an int for varints and a string for length delimited
+    fields."""
+
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('Unsupported wire type {0}'.format(wire_type))
+        yield number, wire_type, value
+
+
+def read_packed(values, wire_type, value):
+    """Add the varints of a packed (or single, unpacked) field to
+    list `values`."""
+
+    if wire_type == 0:
+        values.append(value)
+        return
+    pos = 0
+    end = len(value)
+    while pos < end:
+        item, pos = read_varint(value, pos)
+        values.append(item)
+
+
+def delta_decode(values, decode=zigzag):
+    """Return list of running sums of the decoded `values`."""
+
+    result = []
+    total = 0
+    for value in values:
+        total += decode(value)
+        result.append(total)
+    return result
+
+
+# --- Blocks ---
+# ////////////////////////////////////////////////////////////////////
+
+class BlockContext(object):
+    """String table and coordinate/date settings of a PrimitiveBlock."""
+
+    def __init__(self):
+        self.strings = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        self.date_granularity = 1000
+
+    def coordinate(self, value, offset):
+        """Return coordinate as string like in OSM XML."""
+
+        degrees = 1e-9 * (offset + self.granularity * value)
+        return ('%.7f' % degrees).rstrip('0').rstrip('.')
+
+    def timestamp(self, value):
+        """Return timestamp as string like in OSM XML."""
+
+        seconds = value * self.date_granularity // 1000
+        return datetime.utcfromtimestamp(seconds).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
+
+
+def read_info(buf, ctx, attrib):
+    """Add the attributes of an Info message to dict `attrib`."""
+
+    for number, _, value in iter_fields(buf):
+        if number == 1:
+            attrib['version'] = str(value)
+        elif number == 2:
+            attrib['timestamp'] = ctx.timestamp(to_signed(value))
+        elif number == 3:
+            attrib['changeset'] = str(to_signed(value))
+        elif number == 4:
+            attrib['uid'] = str(to_signed(value))
+        elif number == 5:
+            attrib['user'] = ctx.strings[value]
+
+
+def make_tags(ctx, keys, vals):
+    """Return list of `tag` children for the string ids of keys and values."""
+
+    return [ChildRecord('tag', {'k': ctx.strings[k], 'v': ctx.strings[v]})
+            for k, v in zip(keys, vals)]
+
+
+def read_node(buf, ctx):
+    attrib = {}
+    keys = []
+    vals = []
+    lat = lon = 0
+    for number, wire_type, value in iter_fields(buf):
+        if number == 1:
+            attrib['id'] = str(zigzag(value))
+        elif number == 2:
+            read_packed(keys, wire_type, value)
+        elif number == 3:
+            read_packed(vals, wire_type, value)
+        elif number == 4:
+            read_info(value, ctx, attrib)
+        elif number == 8:
+            lat = zigzag(value)
+        elif number == 9:
+            lon = zigzag(value)
+    attrib['lat'] = ctx.coordinate(lat, ctx.lat_offset)
+    attrib['lon'] = ctx.coordinate(lon, ctx.lon_offset)
+    record = Record('node', attrib)
+    record.children = make_tags(ctx, keys, vals)
+    return record
+
+
+def read_dense_info(buf, ctx, count):
+    """Return list of attribute dicts of the DenseInfo of `count` nodes."""
+
+    fields = {}
+    for number, wire_type, value in iter_fields(buf):
+        read_packed(fields.setdefault(number, []), wire_type, value)
+
+    infos = [{} for _ in range(count)]
+    if 1 in fields:
+        for info, version in zip(infos, fields[1]):
+            info['version'] = str(to_signed(version))
+    if 2 in fields:
+        for info, timestamp in zip(infos, delta_decode(fields[2])):
+            info['timestamp'] = ctx.timestamp(timestamp)
+    if 3 in fields:
+        for info, changeset in zip(infos, delta_decode(fields[3])):
+            info['changeset'] = str(changeset)
+    if 4 in fields:
+        for info, uid in zip(infos, delta_decode(fields[4])):
+            info['uid'] = str(uid)
+    if 5 in fields:
+        for info, user_sid in zip(infos, delta_decode(fields[5])):
+            info['user'] = ctx.strings[user_sid]
+    return infos
+
+
+def read_dense_nodes(buf, ctx):
+    ids = []
+    lats = []
+    lons = []
+    keys_vals = []
+    dense_info = None
+    for number, wire_type, value in iter_fields(buf):
+        if number == 1:
+            read_packed(ids, wire_type, value)
+        elif number == 5:
+            dense_info = value
+        elif number == 8:
+            read_packed(lats, wire_type, value)
+        elif number == 9:
+            read_packed(lons, wire_type, value)
+        elif number == 10:
+            read_packed(keys_vals, wire_type, value)
+
+    ids = delta_decode(ids)
+    lats = delta_decode(lats)
+    lons = delta_decode(lons)
+    if dense_info is not None:
+        infos = read_dense_info(dense_info, ctx, len(ids))
+    else:
+        infos = [{} for _ in ids]
+
+    records = []
+    kv_pos = 0
+    for node_id, lat, lon, attrib in zip(ids, lats, lons, infos):
+        attrib['id'] = str(node_id)
+        attrib['lat'] = ctx.coordinate(lat, ctx.lat_offset)
+        attrib['lon'] = ctx.coordinate(lon, ctx.lon_offset)
+        record = Record('node', attrib)
+        # keys and values of all nodes, each node ends with a 0
+        while kv_pos < len(keys_vals) and keys_vals[kv_pos] != 0:
+            record.children.append(ChildRecord('tag', {
+                'k': ctx.strings[keys_vals[kv_pos]],
+                'v': ctx.strings[keys_vals[kv_pos + 1]]}))
+            kv_pos += 2
+        kv_pos += 1
+        records.append(record)
+    return records
+
+
+def read_way(buf, ctx):
+    attrib = {}
+    keys = []
+    vals = []
+    refs = []
+    for number, wire_type, value in iter_fields(buf):
+        if number == 1:
+            attrib['id'] = str(to_signed(value))
+        elif number == 2:
+            read_packed(keys, wire_type, value)
+        elif number == 3:
+            read_packed(vals, wire_type, value)
+        elif number == 4:
+            read_info(value, ctx, attrib)
+        elif number == 8:
+            read_packed(refs, wire_type, value)
+    record = Record('way', attrib)
+    record.children = make_tags(ctx, keys, vals)
+    record.children.extend(ChildRecord('nd', {'ref': str(ref)})
+                           for ref in delta_decode(refs))
+    return record
+
+
+def read_relation(buf, ctx):
+    attrib = {}
+    keys = []
+    vals = []
+    roles = []
+    member_ids = []
+    types = []
+    for number, wire_type, value in iter_fields(buf):
+        if number == 1:
+            attrib['id'] = str(to_signed(value))
+        elif number == 2:
+            read_packed(keys, wire_type, value)
+        elif number == 3:
+            read_packed(vals, wire_type, value)
+        elif number == 4:
+            read_info(value, ctx, attrib)
+        elif number == 8:
+            read_packed(roles, wire_type, value)
+        elif number == 9:
+            read_packed(member_ids, wire_type, value)
+        elif number == 10:
+            read_packed(types, wire_type, value)
+    record = Record('relation', attrib)
+    record.children = make_tags(ctx, keys, vals)
+    record.children.extend(
+        ChildRecord('member', {'type': MEMBER_TYPES[member_type],
+                               'ref': str(ref),
+                               'role': ctx.strings[role]})
+        for member_type, ref, role in zip(types, delta_decode(member_ids),
+                                          roles))
+    return record
+
+
+def read_primitive_block(data, tags=TOP_LEVEL_TAGS):
+    """Return list of `Record`s of type `tags` in a PrimitiveBlock."""
+
+    ctx = BlockContext()
+    groups = []
+    for number, _, value in iter_fields(data):
+        if number == 1:
+            ctx.strings = [s for n, _, s in iter_fields(value) if n == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            ctx.granularity = value
+        elif number == 18:
+            ctx.date_granularity = value
+        elif number == 19:
+            ctx.lat_offset = to_signed(value)
+        elif number == 20:
+            ctx.lon_offset = to_signed(value)
+
+    records = []
+    for group in groups:
+        for number, _, value in iter_fields(group):
+            if number == 1 and 'node' in tags:
+                records.append(read_node(value, ctx))
+            elif number == 2 and 'node' in tags:
+                records.extend(read_dense_nodes(value, ctx))
+            elif number == 3 and 'way' in tags:
+                records.append(read_way(value, ctx))
+            elif number == 4 and 'relation' in tags:
+                records.append(read_relation(value, ctx))
+    return records
+
+
+# --- File ---
+# ////////////////////////////////////////////////////////////////////
+
+def read_blobs(pbf_file):
+    """Yield tuples of type and Blob message of each blob in the file."""
+
+    while True:
+        size = pbf_file.read(4)
+        if len(size) < 4:
+            return
+        header = pbf_file.read(struct.unpack('>I', size)[0])
+        blob_type = None
+        data_size = 0
+        for number, _, value in iter_fields(header):
+            if number == 1:
+                blob_type = value
+            elif number == 3:
+                data_size = value
+        yield blob_type, pbf_file.read(data_size)
+
+
+def decompress_blob(blob):
+    """Return the uncompressed data of a Blob message."""
+
+    for number, _, value in iter_fields(blob):
+        if number == 1:
+            return value
+        elif number == 3:
+            return zlib.decompress(value)
+        elif number in (4, 5, 6, 7):
+            raise ValueError('Unsupported blob compression '
+                             '(field {0})'.format(number))
+    return ''
+
+
+def decode_blob(job):
+    """Decompress and decode an OSMData blob. Takes a tuple of blob and
+    tags, returns list of tuples (tag, attrib, children), which can be
+    passed between processes."""
+
+    blob, tags = job
+    return [(record.tag, record.attrib,
+             [(child.tag, child.attrib) for child in record.children])
+            for record in read_primitive_block(decompress_blob(blob), tags)]
+
+
+def to_record(item):
+    """Return `Record` from a tuple of `decode_blob`."""
+
+    tag, attrib, children = item
+    record = Record(tag, attrib)
+    record.children = [ChildRecord(child_tag, child_attrib)
+                       for child_tag, child_attrib in children]
+    return record
+
+
+def get_element_pbf(osm_file, tags=TOP_LEVEL_TAGS, workers=1):
+    """Yield `Record` if it is the right type of tag, read from PBF.
+    With `workers` > 1 the blobs are decoded in a process pool."""
+
+    close_file = not hasattr(osm_file, 'read')
+    if close_file:
+        osm_file = open(osm_file, 'rb')
+    pool = None
+    try:
+        jobs = ((blob, tags) for blob_type, blob in read_blobs(osm_file)
+                if blob_type == 'OSMData')
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            # decode a limited number of blobs ahead, in file order
+            pending = deque()
+            for job in jobs:
+                pending.append(pool.apply_async(decode_blob, (job,)))
+                if len(pending) >= workers * BLOBS_PER_WORKER:
+                    for item in pending.popleft().get():
+                        yield to_record(item)
+            while pending:
+                for item in pending.popleft().get():
+                    yield to_record(item)
+        else:
+            for blob, _ in jobs:
+                for record in read_primitive_block(decompress_blob(blob),
+                                                   tags):
+                    yield record
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if close_file:
+            osm_file.close()
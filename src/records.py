@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Lightweight OSM element records.
+
+Used by the parser backends, that don't build an ElementTree (expat, PBF).
+The records have the `tag`, `attrib` and `iter(tag)` interface of tree
+elements, that `cleaning.shape_element` and `check_correct` use.
+
+`Way` keeps the node refs of a shaped way in an array instead of one row
+per node.
+"""
+
+from array import array
+
+
+def get_node_id_type():
+    """Return array type code of 64 bit integers or None, if there is none.
+
+    'q' is missing in Python 2, where 'l' is 64 bit on 64 bit Linux and
+    macOS, but 32 bit on Windows.
+    """
+
+    for type_code in ('q', 'l'):
+        try:
+            if array(type_code).itemsize >= 8:
+                return type_code
+        except ValueError:
+            pass
+    return None
+
+
+# Array type code of the node ids, without one they are kept in lists
+NODE_ID_TYPE = get_node_id_type()
+
+
+def node_id_array(node_ids=()):
+    """Return array of `NODE_ID_TYPE` (or list) of the ints `node_ids`."""
+
+    if NODE_ID_TYPE is None:
+        return list(node_ids)
+    return array(NODE_ID_TYPE, node_ids)
+
+
+class ChildRecord(object):
+    """`tag`, `nd` or `member` child of a `Record`."""
+
+    __slots__ = ('tag', 'attrib')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+
+
+class Record(object):
+    """Lightweight node, way or relation."""
+
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = []
+
+    def iter(self, tag):
+        """Iterate over the children of type `tag`."""
+
+        return (child for child in self.children if child.tag == tag)
+
+
+class Way(object):
+    """Way id and its node ids in an array of `NODE_ID_TYPE`, see
+    `node_id_array`.
+
+    Iterating yields the `(id, node_id, position)` rows of `ways_nodes`,
+    the sinks write the array in bulk instead.
+    """
+
+    __slots__ = ('id', 'node_ids')
+
+    def __init__(self, way_id, node_ids=None):
+        self.id = way_id
+        self.node_ids = node_ids if node_ids is not None else \
+            node_id_array()
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __iter__(self):
+        way_id = self.id
+        for position, node_id in enumerate(self.node_ids):
+            yield way_id, node_id, position
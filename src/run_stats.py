@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Per-stage timers, counters and a progress line for `cleaning.py`.
+
+`RunStats` collects the cumulative time of the stages of `process_map`
+(parsing, shaping, corrections, validation and writing), the number of
+elements by type and of tags. A progress line with the elements per second,
+the bytes of the input file read so far and the estimated remaining time is
+written to stderr at most every `PROGRESS_INTERVAL` seconds.
+
+The statistics are only collected with `cleaning.py --stats`, without it
+`process_map` runs the uninstrumented loop.
+"""
+
+import sys
+import time
+
+from collections import Counter
+
+import check_correct as CC
+
+STAGES = ('parse', 'shape', 'correct', 'validate', 'write')
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 1.0
+
+# Functions of `check_correct`, that are timed as the `correct` stage
+CORRECT_FUNCTIONS = ('correct_node', 'correct_way', 'correct_relation')
+
+
+def file_position(f):
+    """Return the number of bytes read from the input file `f`."""
+
+    # compressed input (see `compressed.ThreadedDecompressor`)
+    if hasattr(f, 'bytes_read'):
+        return f.bytes_read
+    return f.tell()
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+
+class RunStats(object):
+    """Statistics of a run over an input of `total_bytes` bytes.
+
+    `position` returns the bytes read so far. The progress line is written
+    to `out`, or not at all if it is None.
+    """
+
+    def __init__(self, total_bytes=None, position=None, out=sys.stderr,
+                 interval=PROGRESS_INTERVAL):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.counts = Counter()
+        self.total_bytes = total_bytes
+        self.position = position
+        self.bytes_done = 0
+        self.out = out
+        self.interval = interval
+        self.start_time = time.time()
+        self.next_progress = self.start_time + interval
+        self.originals = {}
+
+    def add_element(self, tag, el):
+        """Count element of type `tag` and its shaped tags."""
+
+        self.counts[tag] += 1
+        tags = el.get(tag + '_tags')
+        if tags:
+            self.counts['tags'] += len(tags)
+
+    # --- Timing of the Corrections ---
+
+    def start_correct_timer(self):
+        """Replace the correct functions of `check_correct` by timed ones,
+        until `stop_correct_timer` is called."""
+
+        for name in CORRECT_FUNCTIONS:
+            self.originals[name] = getattr(CC, name)
+            setattr(CC, name, self.timed(self.originals[name]))
+
+    def stop_correct_timer(self):
+        for name, function in self.originals.iteritems():
+            setattr(CC, name, function)
+        self.originals = {}
+
+    def timed(self, correct_f):
+        times = self.times
+        clock = time.time
+
+        def timed_correct(tag):
+            start = clock()
+            correct_f(tag)
+            times['correct'] += clock() - start
+
+        return timed_correct
+
+    # --- Progress ---
+
+    def progress(self, now=None, force=False):
+        """Write the progress line, if the interval has passed."""
+
+        now = now or time.time()
+        if self.out is None or (not force and now < self.next_progress):
+            return
+        self.next_progress = now + self.interval
+        if self.position is not None:
+            self.bytes_done = self.position()
+
+        elapsed = max(now - self.start_time, 1e-6)
+        elements = sum(self.counts[t] for t in ('node', 'way', 'relation'))
+        line = '{0} elements, {1:.0f} el/s, {2:.1f} MB'.format(
+            elements, elements / elapsed, self.bytes_done / 1e6)
+        if self.total_bytes:
+            line += ' of {0:.1f} MB'.format(self.total_bytes / 1e6)
+            if self.bytes_done:
+                remaining = elapsed * (self.total_bytes - self.bytes_done) / \
+                    self.bytes_done
+                line += ', ETA {0}'.format(format_duration(max(remaining, 0)))
+        self.out.write('\r' + line.ljust(79))
+        self.out.flush()
+
+    # --- Results ---
+
+    def get_state(self):
+        """Return the timers and counters as picklable tuple."""
+
+        return self.times, self.counts
+
+    def merge_state(self, state):
+        """Add the timers and counters of another run (see `get_state`)."""
+
+        times, counts = state
+        for stage, seconds in times.iteritems():
+            self.times[stage] += seconds
+        self.counts.update(counts)
+
+    def write_report(self, f):
+        """Write the time of each stage and the counters to file `f`."""
+
+        self.progress(force=True)
+        if self.out is not None:
+            self.out.write('\n')
+        total = time.time() - self.start_time
+        # the correct stage is part of the shape timer
+        times = dict(self.times)
+        times['shape'] -= times['correct']
+
+        # in parallel mode the stages of the workers overlap, so the shares
+        # are relative to their sum and not to the total time
+        stages_total = max(sum(times.itervalues()), 1e-6)
+
+        f.write('Total {0:.1f}s\n'.format(total))
+        for stage in STAGES:
+            f.write('{0:<10}{1:8.1f}s {2:6.1%}\n'.format(
+                stage, times[stage], times[stage] / stages_total))
+        for key, label in (('node', 'nodes'), ('way', 'ways'),
+                           ('relation', 'relations'), ('tags', 'tags')):
+            f.write('{0:<10}{1:>9}\n'.format(label, self.counts[key]))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Split an OSM file into byte ranges that can be parsed independently.
+
+Every shard starts at the beginning of a top level element (`<node>`, `<way>`
+or `<relation>`), so each shard read through `ShardReader` is a well formed
+document of its own. The shards cover all elements of the file in order.
+"""
+
+import os
+import re
+
+# start of a top level element; `<nd>`, `<tag>` and `<member>` don't match
+ELEMENT_START = re.compile(r'<(?:node|way|relation)[\s/>]')
+DOCUMENT_END = '</osm>'
+BLOCK_SIZE = 64 * 1024
+
+
+def find_element_start(osm_file, offset):
+    """Return the byte offset of the first element starting at or after
+    `offset` in the opened `osm_file`. Return None, if there is none.
+    """
+
+    osm_file.seek(offset)
+    buf = ''
+    buf_start = offset
+    while True:
+        block = osm_file.read(BLOCK_SIZE)
+        if not block:
+            return None
+        buf += block
+        match = ELEMENT_START.search(buf)
+        if match:
+            return buf_start + match.start()
+        # keep the end of the block, a tag could be split between blocks
+        buf_start += len(buf) - 16
+        buf = buf[-16:]
+
+
+def find_document_end(osm_file, size):
+    """Return the byte offset of the closing `</osm>` tag
+    or `size`, if the file is not closed properly.
+    """
+
+    offset = max(0, size - BLOCK_SIZE)
+    osm_file.seek(offset)
+    pos = osm_file.read().rfind(DOCUMENT_END)
+    if pos < 0:
+        return size
+    return offset + pos
+
+
+def get_shards(filename, count, offset=0):
+    """Split `filename` from byte `offset` on into (up to) `count` shards.
+    Return list of (start, end) byte ranges in file order.
+    """
+
+    size = os.path.getsize(filename)
+    starts = []
+    with open(filename, 'rb') as f:
+        for i in range(count):
+            start = find_element_start(
+                f, offset + (size - offset) * i // count)
+            if start is None:
+                break
+            if not starts or start != starts[-1]:
+                starts.append(start)
+        end = find_document_end(f, size)
+
+    ends = starts[1:] + [end]
+    return [(start, end) for start, end in zip(starts, ends) if start < end]
+
+
+class ShardReader(object):
+    """Read the byte range [`start`, `end`) of an OSM file as a document.
+
+    The range is wrapped in an `<osm>` root element, so the reader can be
+    passed to `ET.iterparse` like an ordinary file.
+    """
+
+    def __init__(self, filename, start, end):
+        self._file = open(filename, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+        self._head = '<osm>'
+        self._tail = DOCUMENT_END
+
+    def read(self, size=-1):
+        """Read up to `size` bytes (everything, if `size` is negative)."""
+
+        if size < 0:
+            size = len(self._head) + self._remaining + len(self._tail)
+
+        data = self._head[:size]
+        self._head = self._head[len(data):]
+
+        if self._remaining > 0 and len(data) < size:
+            chunk = self._file.read(min(size - len(data), self._remaining))
+            self._remaining = self._remaining - len(chunk) if chunk else 0
+            data += chunk
+
+        if self._remaining == 0 and len(data) < size:
+            tail = self._tail[:size - len(data)]
+            self._tail = self._tail[len(tail):]
+            data += tail
+
+        return data
+
+    def tell(self):
+        """Return the current byte offset in the OSM file."""
+
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
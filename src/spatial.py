@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Spatial queries over the nodes and ways of the SQLite database.
+
+`cleaning.py --db` builds the R*Tree `nodes_rtree` of the node coordinates
+(see `data_wrangling_indexes.sql`), `geometry.py --db` fills `ways_rtree`
+with the bounding boxes of the ways. `SpatialIndex` answers bounding box and
+k-nearest-neighbour queries with them, instead of scanning the tables.
+
+The nearest neighbours are found with bounding box queries of growing size
+and sorted by their great-circle distance in meters.
+"""
+
+import sys
+import math
+import sqlite3
+import argparse
+
+from geometry import distance, EARTH_RADIUS
+
+METERS_PER_DEGREE = math.radians(1) * EARTH_RADIUS
+
+# Start radius of the nearest neighbour search in meters, it is doubled until
+# enough candidates are found
+SEARCH_RADIUS = 100.0
+MAX_SEARCH_RADIUS = 2.0e7
+
+# The R*Tree stores 32 bit floats, so the exact coordinates are checked in
+# the tables as well
+NODES_IN_BBOX = '''
+    SELECT n.id, n.lat, n.lon FROM nodes_rtree r JOIN nodes n ON n.id = r.id
+    WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat
+      AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon
+      AND n.lat BETWEEN :min_lat AND :max_lat
+      AND n.lon BETWEEN :min_lon AND :max_lon'''
+
+WAYS_IN_BBOX = '''
+    SELECT g.id, g.min_lat, g.min_lon, g.max_lat, g.max_lon
+    FROM ways_rtree r JOIN ways_geometry g ON g.id = r.id
+    WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat
+      AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon
+      AND g.max_lat >= :min_lat AND g.min_lat <= :max_lat
+      AND g.max_lon >= :min_lon AND g.min_lon <= :max_lon'''
+
+
+def bbox_around(lat, lon, radius):
+    """Return tuple of min lat, min lon, max lat and max lon of a box that
+    contains the circle of `radius` meters around the point."""
+
+    d_lat = radius / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + d_lat, 90.0)))
+    d_lon = min(radius / (METERS_PER_DEGREE * max(cos_lat, 1e-9)), 360.0)
+    return lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon
+
+
+def bbox_distance(lat, lon, min_lat, min_lon, max_lat, max_lon):
+    """Return distance in meters from the point to the bounding box,
+    0 if it is inside."""
+
+    return distance(lat, lon, min(max(lat, min_lat), max_lat),
+                    min(max(lon, min_lon), max_lon))
+
+
+class SpatialIndex(object):
+    """Bounding box and nearest neighbour queries on the database at
+    `db_path`."""
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+
+    def query(self, sql, min_lat, min_lon, max_lat, max_lon):
+        return self.conn.execute(sql, {
+            'min_lat': min_lat, 'min_lon': min_lon,
+            'max_lat': max_lat, 'max_lon': max_lon}).fetchall()
+
+    def nodes_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Return list of (id, lat, lon) of the nodes in the bounding box."""
+
+        return self.query(NODES_IN_BBOX, min_lat, min_lon, max_lat, max_lon)
+
+    def ways_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Return list of (id, min lat, min lon, max lat, max lon) of the
+        ways, whose bounding box intersects the given one."""
+
+        return self.query(WAYS_IN_BBOX, min_lat, min_lon, max_lat, max_lon)
+
+    def nearest(self, sql, lat, lon, k, distance_f):
+        """Return the `k` results of `sql` with the smallest `distance_f`
+        as list of (distance, row) tuples, closest first. Raise ValueError,
+        if `k` is less than 1."""
+
+        if k < 1:
+            raise ValueError('k must be at least 1, not {0}'.format(k))
+        radius = SEARCH_RADIUS
+        while True:
+            rows = self.query(sql, *bbox_around(lat, lon, radius))
+            if len(rows) >= k or radius >= MAX_SEARCH_RADIUS:
+                break
+            radius *= 2
+
+        ranked = sorted((distance_f(row), row) for row in rows)[:k]
+        if len(ranked) == k and ranked[-1][0] > radius:
+            # closer rows can be outside of the box, but not outside of
+            # the one around the distance of the kth row
+            rows = self.query(sql, *bbox_around(lat, lon, ranked[-1][0]))
+            ranked = sorted((distance_f(row), row) for row in rows)[:k]
+        return ranked
+
+    def nearest_nodes(self, lat, lon, k=1):
+        """Return list of (distance, id, lat, lon) of the `k` nodes closest
+        to the point, distances in meters."""
+
+        ranked = self.nearest(
+            NODES_IN_BBOX, lat, lon, k,
+            lambda row: distance(lat, lon, row[1], row[2]))
+        return [(d,) + tuple(row) for d, row in ranked]
+
+    def nearest_ways(self, lat, lon, k=1):
+        """Return list of (distance, id, min lat, min lon, max lat, max lon)
+        of the `k` ways with the bounding boxes closest to the point."""
+
+        ranked = self.nearest(
+            WAYS_IN_BBOX, lat, lon, k,
+            lambda row: bbox_distance(lat, lon, *row[1:]))
+        return [(d,) + tuple(row) for d, row in ranked]
+
+    def close(self):
+        self.conn.close()
+
+
+def update_nodes(db_path, ids):
+    """Replace the entries of the nodes with `ids` in `nodes_rtree`, e.g.
+    after an OsmChange file is applied."""
+
+    rows = [(int(node_id),) for node_id in ids]
+    conn = sqlite3.connect(db_path)
+    conn.executemany('DELETE FROM nodes_rtree WHERE id = ?', rows)
+    conn.executemany('INSERT INTO nodes_rtree SELECT id, lat, lat, lon, lon '
+                     'FROM nodes WHERE id = ? AND lat IS NOT NULL '
+                     'AND lon IS NOT NULL', rows)
+    conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Query nodes and ways by location.')
+    parser.add_argument('db_path', help='SQLite database of cleaning.py')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--bbox', type=float, nargs=4,
+                       metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                       help='elements in this bounding box')
+    group.add_argument('--near', type=float, nargs=2,
+                       metavar=('LAT', 'LON'),
+                       help='elements closest to this point')
+    parser.add_argument('-k', type=int, default=5,
+                        help='number of elements closest to the point '
+                             '(default: 5)')
+    parser.add_argument('--ways', action='store_true',
+                        help='query the way bounding boxes instead of the '
+                             'nodes (needs geometry.py --db)')
+    args = parser.parse_args()
+    if args.k < 1:
+        parser.error('-k must be at least 1')
+
+    index = SpatialIndex(args.db_path)
+    if args.bbox is not None:
+        if args.ways:
+            rows = index.ways_in_bbox(*args.bbox)
+        else:
+            rows = index.nodes_in_bbox(*args.bbox)
+    elif args.ways:
+        rows = index.nearest_ways(args.near[0], args.near[1], args.k)
+    else:
+        rows = index.nearest_nodes(args.near[0], args.near[1], args.k)
+    index.close()
+
+    for row in rows:
+        sys.stdout.write('\t'.join(str(value) for value in row) + '\n')
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Load shaped OSM elements directly into an SQLite database.
+
+The tables are created from `data_wrangling_schema.sql`. Rows are collected
+in batches and inserted with `executemany`, journaling and synchronous writes
+are turned off during the load. The indexes of `data_wrangling_indexes.sql`
+are built after all rows are loaded.
+
+With `create=False` the sink writes to the tables of an existing database,
+e.g. to apply the changes of an OsmChange file.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+from itertools import count, izip, repeat
+
+from util import to_unicode
+
+SCHEMA_FILE = 'data_wrangling_schema.sql'
+INDEX_FILE = 'data_wrangling_indexes.sql'
+
+# Number of rows per table that are inserted at once
+BATCH_SIZE = 50000
+
+# Table name and columns, in the order of the sql schema
+NODES = ('nodes', ('id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset',
+                   'timestamp'))
+NODES_TAGS = ('nodes_tags', ('id', 'key', 'value', 'type'))
+WAYS = ('ways', ('id', 'user', 'uid', 'version', 'changeset', 'timestamp'))
+WAYS_NODES = ('ways_nodes', ('id', 'node_id', 'position'))
+WAYS_TAGS = ('ways_tags', ('id', 'key', 'value', 'type'))
+RELATIONS = ('relations', ('id', 'user', 'uid', 'version', 'changeset',
+                           'timestamp'))
+RELATIONS_MEMBERS = ('relations_members', ('id', 'member_id', 'member_type',
+                                           'role', 'position'))
+RELATIONS_TAGS = ('relations_tags', ('id', 'key', 'value', 'type'))
+# filled by `geometry.py --db`, only deleted here
+WAYS_GEOMETRY = ('ways_geometry', ('id',))
+
+
+def read_sql(sql_file):
+    """Return the content of `sql_file`."""
+
+    with open(sql_file) as f:
+        return f.read()
+
+
+class SqliteSink(object):
+    """Write shaped elements to the SQLite database at `db_path`.
+
+    If `create` is True, an existing database file is replaced. Otherwise
+    the rows are added to the existing tables and indexes.
+    """
+
+    def __init__(self, db_path, schema_file=SCHEMA_FILE,
+                 index_file=INDEX_FILE, batch_size=BATCH_SIZE, create=True):
+        if create and os.path.exists(db_path):
+            os.remove(db_path)
+
+        self.conn = sqlite3.connect(db_path)
+        if create:
+            self.conn.execute('PRAGMA journal_mode = OFF')
+            self.conn.execute('PRAGMA synchronous = OFF')
+            self.conn.executescript(read_sql(schema_file))
+
+        self.create = create
+        self.index_file = index_file
+        self.batch_size = batch_size
+        self.batches = {}
+        self.row_count = 0
+        self.start_time = time.time()
+
+    def add_rows(self, table, rows):
+        """Add `rows` (tuples in column order) to the batch of `table`,
+        insert if full."""
+
+        batch = self.batches.setdefault(table, [])
+        for row in rows:
+            batch.append([to_unicode(value) for value in row])
+        if len(batch) >= self.batch_size:
+            self.insert(table)
+
+    def add_way_nodes(self, way):
+        """Add the `ways_nodes` rows of `records.Way` `way` to the batch."""
+
+        batch = self.batches.setdefault(WAYS_NODES, [])
+        batch.extend(izip(repeat(int(way.id)), way.node_ids, count()))
+        if len(batch) >= self.batch_size:
+            self.insert(WAYS_NODES)
+
+    def insert(self, table):
+        """Insert the batch of `table` in one transaction."""
+
+        name, columns = table
+        batch = self.batches.pop(table, [])
+        if batch:
+            self.conn.executemany(
+                'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+                    name, ', '.join(columns), ', '.join('?' * len(columns))),
+                batch)
+            self.conn.commit()
+            self.row_count += len(batch)
+
+    def delete(self, tables, ids):
+        """Delete all rows of the elements with `ids` from `tables`."""
+
+        rows = [(to_unicode(element_id),) for element_id in ids]
+        for name, _ in tables:
+            self.conn.executemany(
+                'DELETE FROM {0} WHERE id = ?'.format(name), rows)
+        self.conn.commit()
+
+    def delete_nodes(self, ids):
+        self.delete((NODES, NODES_TAGS), ids)
+
+    def delete_ways(self, ids):
+        self.delete((WAYS, WAYS_NODES, WAYS_TAGS, WAYS_GEOMETRY), ids)
+
+    def delete_relations(self, ids):
+        self.delete((RELATIONS, RELATIONS_MEMBERS, RELATIONS_TAGS), ids)
+
+    def write_node(self, el):
+        self.add_rows(NODES, [el['node']])
+        self.add_rows(NODES_TAGS, el['node_tags'])
+
+    def write_way(self, el):
+        self.add_rows(WAYS, [el['way']])
+        self.add_way_nodes(el['way_nodes'])
+        self.add_rows(WAYS_TAGS, el['way_tags'])
+
+    def write_relation(self, el):
+        self.add_rows(RELATIONS, [el['relation']])
+        self.add_rows(RELATIONS_MEMBERS, el['relation_members'])
+        self.add_rows(RELATIONS_TAGS, el['relation_tags'])
+
+    def close(self):
+        """Insert the remaining rows, build the indexes and report
+        the throughput."""
+
+        for table in self.batches.keys():
+            self.insert(table)
+        load_time = time.time() - self.start_time
+
+        if self.create:
+            self.conn.executescript(read_sql(self.index_file))
+            self.conn.execute('PRAGMA synchronous = FULL')
+            self.conn.commit()
+        self.conn.close()
+        total_time = time.time() - self.start_time
+
+        sys.stderr.write(
+            'Loaded {0} rows in {1:.1f}s ({2:.0f} rows/s), '
+            'indexes built in {3:.1f}s\n'.format(
+                self.row_count, load_time,
+                self.row_count / max(load_time, 1e-6),
+                total_time - load_time))
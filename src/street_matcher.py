@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Propose corrections of bad street names by fuzzy matching.
+
+The known good street names are indexed by their trigrams and sizes. For a
+bad name only the names of a similar size, that share its rarest trigrams,
+are compared (length and prefix filters, see `TrigramIndex.search`), so a
+lookup does not scan all names. The similarity is the Jaccard index of the
+trigram sets of the normalized names: lower case, without spaces and
+hyphens and with `str.` expanded to `straße`.
+
+Good names are the ones of `audited-street-names.txt` (except the lines
+marked with `!`), the replacements of `street-names.txt` and, if an OSM
+file is given, the well formed names in it (see `audit_street_names.py`).
+Bad names are the marked ones and the other names of the OSM file, unless
+they are mapped in `street-names.txt` already.
+
+The best candidate of each bad name is written to a mapping file in the
+`original:replacement` format of `street-names.txt`, to be checked by hand.
+"""
+
+import re
+import sys
+import math
+import heapq
+import argparse
+
+from collections import Counter, defaultdict
+
+import parsers
+import check_correct as CC
+from audit_street_names import STREET_NAME_PATTERN, is_street_name
+from util import to_str, to_unicode
+
+AUDITED_FILE = 'audit-mapping/audited-street-names.txt'
+PROPOSED_FILE = 'audit-mapping/proposed-street-names.txt'
+
+# Lines of bad names in the audited file start with this mark
+BAD_MARK = '!'
+
+# Minimum similarity of a proposed name
+MIN_SCORE = 0.5
+
+ABBREVIATION = re.compile(ur'str\.?$|str\.(?=\s)', re.UNICODE)
+SEPARATORS = re.compile(ur'[\s\-]+', re.UNICODE)
+
+
+def ceil(x):
+    """Return `x` rounded up to int, ignoring rounding errors of floats."""
+
+    return int(math.ceil(x - 1e-9))
+
+
+def floor(x):
+    """Return `x` rounded down to int, ignoring rounding errors of floats."""
+
+    return int(math.floor(x + 1e-9))
+
+
+def max_score(size, other_size):
+    """Return the highest Jaccard index of two sets of these sizes."""
+
+    return float(min(size, other_size)) / max(size, other_size)
+
+
+def normalize(name):
+    """Return the normalized unicode form of street name `name`."""
+
+    name = to_unicode(name).strip().lower()
+    name = ABBREVIATION.sub(u'straße', name)
+    return SEPARATORS.sub(u'', name)
+
+
+def trigrams(name):
+    """Return frozenset of the trigrams of the normalized `name`."""
+
+    padded = u'  ' + normalize(name) + u' '
+    return frozenset(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+
+class TrigramIndex(object):
+    """Index of the street `names` for fuzzy lookups."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.grams = []
+        # positions of the names by trigram and number of trigrams
+        self.postings = defaultdict(lambda: defaultdict(list))
+        self.counts = Counter()
+        # cache of `get_sizes`
+        self.sizes = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        position = len(self.names)
+        grams = trigrams(name)
+        self.names.append(name)
+        self.grams.append(grams)
+        for gram in grams:
+            self.postings[gram][len(grams)].append(position)
+        self.counts.update(grams)
+
+    def search(self, name, k=3, min_score=MIN_SCORE):
+        """Return list of up to `k` (score, name) tuples of the indexed
+        names most similar to `name`, with a score of at least
+        `min_score`, best first.
+
+        Names with a Jaccard index of at least t have between `t * size`
+        and `size / t` trigrams (length filter) and share at least
+        `needed` of them, so they share one of the `size - needed + 1`
+        rarest ones and two of the `size - needed + 2` rarest ones (prefix
+        filter). The name sizes are visited best possible score first and
+        t is raised to the kth best score found, so the later sizes need
+        fewer candidates or are skipped.
+
+        With synthetic names a lookup takes about 0.2 ms for k=3 and 0.1 ms
+        for k=1 with 5k names, 0.35 and 0.1 ms with 20k names and 0.65 and
+        0.2 ms with 80k names.
+        """
+
+        if k < 1 or not 0 < min_score <= 1:
+            raise ValueError('k must be at least 1 and min_score between 0 '
+                             'and 1')
+        grams = trigrams(name)
+        size = len(grams)
+        counts = self.counts
+        rarest = sorted(grams, key=lambda gram: counts.get(gram, 0))
+        postings = [self.postings.get(gram, {}) for gram in rarest]
+        names = self.names
+        all_grams = self.grams
+
+        best = []
+        for other_size, bound in self.get_sizes(size, min_score):
+            threshold = best[0][0] if len(best) == k else min_score
+            if bound < threshold:
+                break
+            needed = ceil(threshold * (size + other_size) / (1 + threshold))
+            prefix = size - needed + 1
+            if prefix < size:
+                # names sharing `needed` trigrams share two of one more
+                seen = set()
+                candidates = set()
+                for gram_postings in postings[:prefix + 1]:
+                    positions = gram_postings.get(other_size, ())
+                    candidates.update(seen.intersection(positions))
+                    seen.update(positions)
+            else:
+                candidates = set()
+                for gram_postings in postings[:prefix]:
+                    candidates.update(gram_postings.get(other_size, ()))
+
+            for position in candidates:
+                shared = len(grams & all_grams[position])
+                if shared < needed:
+                    continue
+                result = (float(shared) / (size + other_size - shared),
+                          names[position])
+                if len(best) < k:
+                    heapq.heappush(best, result)
+                elif result > best[0]:
+                    heapq.heapreplace(best, result)
+        return sorted(best, reverse=True)
+
+    def get_sizes(self, size, min_score):
+        """Return list of (size, highest score) tuples of the names, that
+        can have a score of at least `min_score` with a name of `size`
+        trigrams, highest score first."""
+
+        key = (size, min_score)
+        if key not in self.sizes:
+            self.sizes[key] = sorted(
+                ((other_size, max_score(size, other_size))
+                 for other_size in xrange(ceil(min_score * size),
+                                          floor(size / min_score) + 1)),
+                key=lambda item: -item[1])
+        return self.sizes[key]
+
+
+# --- Input ---
+# ////////////////////////////////////////////////////////////////////
+
+def read_audited(audited_file=AUDITED_FILE):
+    """Return tuple of the sets of good and bad names of `audited_file`."""
+
+    good = set()
+    bad = set()
+    with open(audited_file) as f:
+        for line in f:
+            name = line.rstrip('\r\n')
+            if name.startswith(BAD_MARK):
+                bad.add(name[len(BAD_MARK):])
+            elif name:
+                good.add(name)
+    return good, bad
+
+
+def count_street_names(filename):
+    """Return Counter of the street names of the nodes and ways."""
+
+    names = Counter()
+    for elem in parsers.iter_elements(filename, ('node', 'way')):
+        for tag in elem.iter('tag'):
+            if is_street_name(tag):
+                names[to_str(tag.attrib['v'])] += 1
+    return names
+
+
+def get_names(filename=None, audited_file=AUDITED_FILE):
+    """Return tuple of the set of good names and the Counter of the bad
+    names, that are not mapped yet."""
+
+    good, bad = read_audited(audited_file)
+    mapping = CC.get_street_names_dict()
+    good.update(mapping.itervalues())
+    bad_counts = Counter(dict.fromkeys(bad, 0))
+
+    if filename is not None:
+        for name, count in count_street_names(filename).iteritems():
+            if name in good:
+                continue
+            if STREET_NAME_PATTERN.search(name) and name == name.strip():
+                good.add(name)
+            else:
+                bad_counts[name] += count
+
+    for name in list(bad_counts):
+        if name in mapping or name in good or ':' in name:
+            # `read_mapping` splits at the first colon
+            del bad_counts[name]
+    return good, bad_counts
+
+
+# --- Main ---
+# ////////////////////////////////////////////////////////////////////
+
+def propose(filename=None, out_file=PROPOSED_FILE, k=3, min_score=MIN_SCORE,
+            audited_file=AUDITED_FILE):
+    """Match the bad street names, write the best candidates to `out_file`
+    and return list of (bad name, count, candidates) tuples, most
+    frequent first."""
+
+    good, bad_counts = get_names(filename, audited_file)
+    index = TrigramIndex(sorted(good))
+
+    results = []
+    for name, count in sorted(bad_counts.iteritems(),
+                              key=lambda item: (-item[1], item[0])):
+        results.append((name, count, index.search(name, k, min_score)))
+
+    with open(out_file, 'w') as f:
+        for name, _, candidates in results:
+            if candidates:
+                f.write('{0}:{1}\n'.format(name, candidates[0][1]))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Propose replacements of bad street names.')
+    parser.add_argument('filename', nargs='?',
+                        help='OSM file with more street names (optional)')
+    parser.add_argument('--out', dest='out_file', default=PROPOSED_FILE,
+                        help='proposed mapping file '
+                             '(default: {0})'.format(PROPOSED_FILE))
+    parser.add_argument('-k', type=int, default=3,
+                        help='number of candidates shown (default: 3)')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE,
+                        help='minimum similarity of a candidate between 0 '
+                             'and 1 (default: {0})'.format(MIN_SCORE))
+    args = parser.parse_args()
+    if args.k < 1:
+        parser.error('-k must be at least 1')
+    if not 0 < args.min_score <= 1:
+        parser.error('--min-score must be above 0 and at most 1')
+
+    for name, count, candidates in propose(args.filename, args.out_file,
+                                           args.k, args.min_score):
+        sys.stdout.write('{0}\t{1}\t{2}\n'.format(
+            count, name, '\t'.join('{0} ({1:.2f})'.format(candidate, score)
+                                   for score, candidate in candidates)))
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Generate synthetic OSM XML files of any size for benchmarks.
+
+The file is written as a stream, so the memory use does not depend on the
+size. The same seed gives the same file. About 85% of the elements are
+nodes, 14% ways and 1% relations. Nodes are spread over Munich, ways
+reference nearby node ids and some of them are closed buildings.
+
+The tags follow the audited data: a part of the `addr:city`, `addr:street`
+and `phone` values is dirty, taken from the keys of the mapping files in
+`audit-mapping` and from common phone number formats, so the rules of
+`check_correct` are hit.
+"""
+
+import sys
+import random
+import argparse
+
+from xml.sax.saxutils import quoteattr
+
+import check_correct as CC
+
+NODE_SHARE = 0.85
+WAY_SHARE = 0.14
+
+# Share of tagged nodes and of dirty tag values
+TAGGED_NODE_SHARE = 0.15
+DIRTY_SHARE = 0.2
+
+MIN_LAT, MAX_LAT = 48.06, 48.25
+MIN_LON, MAX_LON = 11.36, 11.72
+USERS = 500
+
+AMENITIES = ('restaurant', 'cafe', 'pharmacy', 'bank', 'school', 'bar',
+             'fast_food', 'kindergarten', 'doctors', 'post_office')
+HIGHWAYS = ('residential', 'service', 'footway', 'secondary', 'primary',
+            'tertiary', 'cycleway', 'track')
+NAMES = ('Alte Post', 'Zum Franziskaner', 'Café Luitpold', 'Sonnen-Apotheke',
+         'Stadtsparkasse', 'Grundschule an der Isar', 'Augustiner Keller')
+PHONE_FORMATS = ('+49 89 {0}', '089 {0}', '089/{0}', '(089) {0}',
+                 '0049 89 {0}', '+49 (0)89 {0}', '+4989{0}', '089-{0}',
+                 '0171 {0}', '+49 171 {0}')
+
+
+class TagValues(object):
+    """Clean and dirty tag values, read from the mapping files."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        city_dict = CC.get_city_dict()
+        street_dict = CC.get_street_names_dict()
+        self.dirty_cities = sorted(city_dict) + sorted(CC.get_munich_names())
+        self.cities = sorted(set(city_dict.values())) + ['München'] * 20
+        self.dirty_streets = sorted(street_dict)
+        self.streets = sorted(set(street_dict.values()))
+
+    def choose(self, clean, dirty):
+        if self.rng.random() < DIRTY_SHARE:
+            return self.rng.choice(dirty)
+        return self.rng.choice(clean)
+
+    def city(self):
+        return self.choose(self.cities, self.dirty_cities)
+
+    def street(self):
+        return self.choose(self.streets, self.dirty_streets)
+
+    def phone(self):
+        number = str(self.rng.randint(100000, 99999999))
+        if self.rng.random() < DIRTY_SHARE:
+            return self.rng.choice(PHONE_FORMATS).format(number)
+        return '+49 89 ' + number
+
+    def address(self):
+        return [('addr:city', self.city()), ('addr:street', self.street()),
+                ('addr:housenumber', str(self.rng.randint(1, 200))),
+                ('addr:postcode', str(self.rng.randint(80331, 81929)))]
+
+
+def format_attributes(rng, element_id):
+    """Return the common attributes of an element as xml string."""
+
+    uid = rng.randint(1, USERS)
+    return ('id="{0}" version="{1}" timestamp="2016-{2:02d}-{3:02d}T12:00:00Z"'
+            ' changeset="{4}" uid="{5}" user="user{5}"'.format(
+                element_id, rng.randint(1, 9), rng.randint(1, 12),
+                rng.randint(1, 28), rng.randint(1, 40000000), uid))
+
+
+def format_tags(tags):
+    return ''.join('  <tag k={0} v={1}/>\n'.format(quoteattr(k), quoteattr(v))
+                   for k, v in tags)
+
+
+def node_tags(rng, values):
+    """Return list of (key, value) of a tagged node."""
+
+    kind = rng.random()
+    if kind < 0.4:
+        tags = [('amenity', rng.choice(AMENITIES)),
+                ('name', rng.choice(NAMES))]
+        tags.extend(values.address())
+        tags.append(('phone', values.phone()))
+        return tags
+    elif kind < 0.7:
+        return values.address()
+    elif kind < 0.85:
+        return [('highway', 'bus_stop'), ('name', values.street())]
+    return [('natural', 'tree')]
+
+
+def way_tags(rng, values, closed):
+    """Return list of (key, value) of a way."""
+
+    if closed:
+        tags = [('building', 'yes')]
+        if rng.random() < 0.5:
+            tags.extend(values.address())
+        return tags
+    return [('highway', rng.choice(HIGHWAYS)), ('name', values.street())]
+
+
+def write_osm(f, elements, seed=0):
+    """Write a synthetic OSM file with about `elements` elements to file
+    `f`. Return tuple of the node, way and relation counts."""
+
+    rng = random.Random(seed)
+    values = TagValues(rng)
+    node_count = max(int(elements * NODE_SHARE), 2)
+    way_count = int(elements * WAY_SHARE)
+    relation_count = max(elements - node_count - way_count, 0)
+
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<osm version="0.6" generator="synthetic_osm.py">\n')
+
+    for node_id in xrange(1, node_count + 1):
+        head = ' <node {0} lat="{1:.7f}" lon="{2:.7f}"'.format(
+            format_attributes(rng, node_id),
+            rng.uniform(MIN_LAT, MAX_LAT), rng.uniform(MIN_LON, MAX_LON))
+        if rng.random() < TAGGED_NODE_SHARE:
+            f.write(head + '>\n' + format_tags(node_tags(rng, values)) +
+                    ' </node>\n')
+        else:
+            f.write(head + '/>\n')
+
+    for way_id in xrange(1, way_count + 1):
+        closed = rng.random() < 0.3
+        size = rng.randint(4, 8) if closed else rng.randint(2, 30)
+        start = rng.randint(1, max(node_count - size, 1))
+        refs = [min(start + i, node_count) for i in xrange(size)]
+        if closed:
+            refs.append(refs[0])
+        f.write(' <way {0}>\n'.format(format_attributes(rng, way_id)) +
+                ''.join('  <nd ref="{0}"/>\n'.format(ref) for ref in refs) +
+                format_tags(way_tags(rng, values, closed)) + ' </way>\n')
+
+    for relation_id in xrange(1, relation_count + 1):
+        members = []
+        for _ in xrange(rng.randint(2, 10)):
+            if way_count and rng.random() < 0.7:
+                members.append(('way', rng.randint(1, way_count), 'outer'))
+            else:
+                members.append(('node', rng.randint(1, node_count), ''))
+        f.write(' <relation {0}>\n'.format(
+                    format_attributes(rng, relation_id)) +
+                ''.join('  <member type="{0}" ref="{1}" role="{2}"/>\n'.format(
+                    *member) for member in members) +
+                format_tags([('type', rng.choice(('multipolygon', 'route'))),
+                             ('name', values.street())]) +
+                ' </relation>\n')
+
+    f.write('</osm>\n')
+    return node_count, way_count, relation_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic OSM file for benchmarks.')
+    parser.add_argument('filename', help='output OSM file')
+    parser.add_argument('--elements', type=int, default=100000,
+                        help='number of elements (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: 0)')
+    args = parser.parse_args()
+
+    with open(args.filename, 'wb') as f:
+        counts = write_osm(f, args.elements, args.seed)
+    sys.stderr.write('Wrote {0} nodes, {1} ways and {2} relations\n'.format(
+        *counts))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Persistent index of the tag statistics used by `explore.py`.
+
+The counts of tag keys and values are stored in an SQLite file next to the
+OSM file (`<osm file>.tagindex.db`), separately for each element type. An
+entry is only used, if size and modification time of the OSM file are still
+the same as at the time it was written. Value counts are loaded per tag key
+on demand, so opening the index is fast also for the full city. If the
+index can not be written, e.g. in a read-only directory, a warning is shown
+and the counts are just not cached. The approximate counts of `--top-k` are stored with their errors (see
+`top_values.py`).
+"""
+
+import os
+import sys
+import sqlite3
+
+from collections import Counter
+
+from util import to_str, to_unicode
+from top_values import TopValues
+
+INDEX_SUFFIX = '.tagindex.db'
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    tag_type TEXT PRIMARY KEY NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    top_k INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS tag_counts (
+    tag_type TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS tag_values (
+    tag_type TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    count INTEGER,
+    error INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS tag_counts_type ON tag_counts (tag_type);
+CREATE INDEX IF NOT EXISTS tag_values_key ON tag_values (tag_type, key);
+'''
+
+
+def get_index_path(filename):
+    """Return path of the index file of OSM file `filename`."""
+
+    return filename + INDEX_SUFFIX
+
+
+def get_signature(filename):
+    """Return tuple of size and modification time of `filename`."""
+
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime
+
+
+def connect(filename):
+    """Open the index of `filename` and create its tables, if necessary."""
+
+    conn = sqlite3.connect(get_index_path(filename))
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(tag_values)')]
+    if columns and 'error' not in columns:
+        # written by an older version, the index is rebuilt
+        conn.executescript('DROP TABLE sources; DROP TABLE tag_counts; '
+                           'DROP TABLE tag_values;')
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+
+class TagValueIndex(object):
+    """Dict-like access to the value counts of the tags of one element
+    type. Each tag key maps to a Counter of its values (`TopValues` of
+    `top_k`, if given), which is read from the index on first access."""
+
+    def __init__(self, conn, tag_type, top_k=None):
+        self.conn = conn
+        self.tag_type = tag_type
+        self.top_k = top_k
+        self.cache = {}
+
+    def __getitem__(self, tag_key):
+        if tag_key not in self.cache:
+            rows = self.conn.execute(
+                'SELECT value, count, error FROM tag_values '
+                'WHERE tag_type = ? AND key = ?',
+                (self.tag_type, to_unicode(tag_key))).fetchall()
+            if not rows:
+                raise KeyError(tag_key)
+            if self.top_k is None:
+                self.cache[tag_key] = Counter(
+                    dict((to_str(value), count) for value, count, _ in rows))
+            else:
+                self.cache[tag_key] = TopValues.from_counts(
+                    self.top_k, ((to_str(value), count, error)
+                                 for value, count, error in rows))
+        return self.cache[tag_key]
+
+    def __contains__(self, tag_key):
+        try:
+            self[tag_key]
+        except KeyError:
+            return False
+        return True
+
+
+def read_index(filename, tag_type, top_k=None):
+    """Return tuple of tag count and `TagValueIndex` from the index of
+    `filename`. Return None, if the index has no current entry for
+    `tag_type` and `top_k` or can not be opened."""
+
+    if not os.path.exists(get_index_path(filename)):
+        return None
+
+    try:
+        conn = connect(filename)
+    except sqlite3.OperationalError as e:
+        sys.stderr.write('Tag index {0} not read: {1}\n'.format(
+            get_index_path(filename), e))
+        return None
+    row = conn.execute('SELECT size, mtime, top_k FROM sources '
+                       'WHERE tag_type = ?', (tag_type,)).fetchone()
+    if row is None or row != get_signature(filename) + (top_k,):
+        conn.close()
+        return None
+
+    tag_count = Counter(dict(
+        (to_str(key), count) for key, count in conn.execute(
+            'SELECT key, count FROM tag_counts WHERE tag_type = ?',
+            (tag_type,))))
+    return tag_count, TagValueIndex(conn, tag_type, top_k)
+
+
+def write_index(filename, tag_type, top_k, tag_count, tag_values_unique):
+    """Replace the index entry of `tag_type` with the given counts. The
+    errors of `TopValues` are stored as well. If the index can not be
+    written, a warning is shown instead."""
+
+    try:
+        write_counts(filename, tag_type, top_k, tag_count, tag_values_unique)
+    except (sqlite3.OperationalError, IOError) as e:
+        sys.stderr.write('Tag index {0} not written: {1}\n'.format(
+            get_index_path(filename), e))
+
+
+def write_counts(filename, tag_type, top_k, tag_count, tag_values_unique):
+    """Write the index entry of `tag_type`, see `write_index`."""
+
+    conn = connect(filename)
+    try:
+        with conn:
+            for table in ('sources', 'tag_counts', 'tag_values'):
+                conn.execute(
+                    'DELETE FROM {0} WHERE tag_type = ?'.format(table),
+                    (tag_type,))
+            conn.executemany(
+                'INSERT INTO tag_counts VALUES (?, ?, ?)',
+                ((tag_type, to_unicode(key), count)
+                 for key, count in tag_count.iteritems()))
+            conn.executemany(
+                'INSERT INTO tag_values VALUES (?, ?, ?, ?, ?)',
+                ((tag_type, to_unicode(key), to_unicode(value), count,
+                  getattr(values, 'errors', {}).get(value, 0))
+                 for key, values in tag_values_unique.iteritems()
+                 for value, count in values.iteritems()))
+            conn.execute('INSERT INTO sources VALUES (?, ?, ?, ?)',
+                         (tag_type,) + get_signature(filename) + (top_k,))
+    finally:
+        conn.close()
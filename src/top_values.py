@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Approximate counts of the most common values of a stream.
+
+`TopValues` implements the Space-Saving algorithm: at most `2 * k` values
+are counted. A new value, that does not fit anymore, replaces a value with
+the minimum count and takes over this count as its error. So a count is
+never too low and at most its error too high, and every value seen more
+often than `n / (2 * k)` times in `n` values is kept.
+
+The values are grouped in buckets by count, so the minimum is found in
+constant time.
+"""
+
+from collections import Counter, defaultdict
+
+
+class TopValues(Counter):
+    """Counter of the about `k` most common values, see the module.
+
+    `errors` maps the values that replaced another one to the maximum
+    overestimation of their count. It is empty, as long as no value was
+    replaced, then the counts are exact.
+    """
+
+    def __init__(self, k):
+        Counter.__init__(self)
+        self.k = k
+        self.capacity = 2 * k
+        self.errors = {}
+        self.buckets = defaultdict(set)
+        self.min_count = 0
+
+    @classmethod
+    def from_counts(cls, k, counts):
+        """Return TopValues of `k` with the (value, count, error) tuples
+        `counts`, e.g. read from `tag_index`."""
+
+        values = cls(k)
+        for value, count, error in counts:
+            values.set_count(value, count)
+            if error:
+                values.errors[value] = error
+        return values
+
+    def set_count(self, value, count):
+        """Set the `count` of a new `value`."""
+
+        self[value] = count
+        self.buckets[count].add(value)
+        if len(self) == 1 or count < self.min_count:
+            self.min_count = count
+
+    def add(self, value):
+        """Count one occurrence of `value`."""
+
+        count = self.get(value)
+        if count is not None:
+            self.buckets[count].discard(value)
+            if not self.buckets[count]:
+                del self.buckets[count]
+                if count == self.min_count:
+                    self.min_count = count + 1
+            self[value] = count + 1
+            self.buckets[count + 1].add(value)
+        elif len(self) < self.capacity:
+            self.set_count(value, 1)
+        else:
+            # replace one of the values with the minimum count
+            min_count = self.min_count
+            bucket = self.buckets[min_count]
+            replaced = bucket.pop()
+            if not bucket:
+                del self.buckets[min_count]
+            del self[replaced]
+            self.errors.pop(replaced, None)
+            self.errors[value] = min_count
+            self[value] = min_count + 1
+            self.buckets[min_count + 1].add(value)
+            if min_count not in self.buckets:
+                self.min_count = min_count + 1
+
+    def error(self, value):
+        """Return the maximum overestimation of the count of `value`."""
+
+        return self.errors.get(value, 0)
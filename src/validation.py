@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Fast validation of shaped elements against `schema.schema`.
+
+The cerberus schema is compiled once into nested check functions for the
+rules used in `schema.py` (`type`, `required`, `coerce` and nested `schema`
+of dicts and lists). Unknown fields are reported like cerberus does.
+
+`FastValidator` checks every element or only every Nth one and collects the
+violations with their count and sample element ids, instead of raising an
+error on the first one.
+"""
+
+from collections import Counter
+
+import schema
+
+# Number of element ids kept per violation
+SAMPLE_IDS = 5
+
+TYPE_CHECKS = {
+    'integer': lambda value: (isinstance(value, (int, long)) and
+                              not isinstance(value, bool)),
+    'float': lambda value: isinstance(value, float),
+    'string': lambda value: isinstance(value, basestring),
+    'dict': lambda value: isinstance(value, dict),
+    'list': lambda value: isinstance(value, list),
+}
+
+
+def compile_rule(rule):
+    """Return function `check(value, path, errors)` for a cerberus `rule`.
+
+    The function appends tuples of field path and error message to the
+    list `errors`.
+    """
+
+    coerce = rule.get('coerce')
+    type_name = rule['type']
+    type_check = TYPE_CHECKS[type_name]
+    type_error = 'must be of {0} type'.format(type_name)
+
+    if type_name == 'dict' and 'schema' in rule:
+        check_items = compile_fields(rule['schema'])
+    elif type_name == 'list' and 'schema' in rule:
+        check_item = compile_rule(rule['schema'])
+
+        def check_items(values, path, errors):
+            for value in values:
+                check_item(value, path, errors)
+    else:
+        check_items = None
+
+    def check(value, path, errors):
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError):
+                errors.append((path, 'field could not be coerced'))
+                return
+        if not type_check(value):
+            errors.append((path, type_error))
+        elif check_items is not None:
+            check_items(value, path, errors)
+
+    return check
+
+
+def compile_fields(fields_schema):
+    """Return function `check(doc, path, errors)` for a dict schema."""
+
+    fields = [(name, rule.get('required', False), compile_rule(rule))
+              for name, rule in fields_schema.iteritems()]
+    known = frozenset(fields_schema)
+
+    def check(doc, path, errors):
+        for name, required, check_field in fields:
+            field_path = path + '.' + name if path else name
+            if name in doc:
+                check_field(doc[name], field_path, errors)
+            elif required:
+                errors.append((field_path, 'required field'))
+        for name in doc:
+            if name not in known:
+                errors.append((path + '.' + name if path else name,
+                               'unknown field'))
+
+    return check
+
+
+def get_element_id(el):
+    """Return id of shaped node, way or relation element `el` (or None)."""
+
+    for key in ('node', 'way', 'relation'):
+        if key in el:
+            return el[key].get('id')
+    return None
+
+
+class FastValidator(object):
+    """Check shaped elements with the compiled `element_schema` and collect
+    the violations. With `every=N` only every Nth element is checked.
+    `prepare` converts the checked elements first, e.g. tuple rows to dicts
+    with `cleaning.element_to_dict`."""
+
+    def __init__(self, element_schema=schema.schema, every=1, prepare=None):
+        if every < 1:
+            raise ValueError('every must be at least 1, not {0}'.format(
+                every))
+        self.check_element = compile_fields(element_schema)
+        self.every = every
+        self.prepare = prepare
+        self.seen = 0
+        self.validated = 0
+        self.violations = Counter()
+        self.sample_ids = {}
+
+    def validate(self, el):
+        """Check element `el`, if it is its turn. Return list of errors."""
+
+        self.seen += 1
+        if (self.seen - 1) % self.every:
+            return []
+
+        self.validated += 1
+        if self.prepare is not None:
+            el = self.prepare(el)
+        errors = []
+        self.check_element(el, '', errors)
+        if errors:
+            element_id = get_element_id(el)
+            for error in errors:
+                self.add_violation(error, 1, [element_id])
+        return errors
+
+    def add_violation(self, error, count, ids):
+        self.violations[error] += count
+        sample_ids = self.sample_ids.setdefault(error, [])
+        sample_ids.extend(ids[:SAMPLE_IDS - len(sample_ids)])
+
+    def get_state(self):
+        """Return the collected counts as picklable tuple."""
+
+        return self.seen, self.validated, self.violations, self.sample_ids
+
+    def merge_state(self, state):
+        """Add the counts of another validator (see `get_state`)."""
+
+        seen, validated, violations, sample_ids = state
+        self.seen += seen
+        self.validated += validated
+        for error, count in violations.iteritems():
+            self.add_violation(error, count, sample_ids.get(error, []))
+
+    def write_report(self, f):
+        """Write the violations to file `f`, most frequent first."""
+
+        f.write('Validated {0} of {1} elements, {2} violations\n'.format(
+            self.validated, self.seen, sum(self.violations.itervalues())))
+        for (path, message), count in self.violations.most_common():
+            f.write('{0}\t{1}: {2}\t{3}\n'.format(
+                count, path, message,
+                ','.join(str(i) for i in self.sample_ids[(path, message)])))